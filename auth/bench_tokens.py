@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Token 索引基准测试 - 对比 dict 与 CompactTokenMap 的内存占用和查找延迟
+
+用法:
+  python bench_tokens.py                    # 100 万个 token
+  python bench_tokens.py -n 5000000         # 500 万个 token
+  python bench_tokens.py --bloom 10         # 同时测试带 Bloom 过滤器的版本
+
+内存用 tracemalloc 统计（包含 token 字符串本身）；
+查找分别测试命中与未命中（随机的无效 token）两种情况。
+"""
+
+import argparse
+import gc
+import random
+import sys
+import time
+import tracemalloc
+
+from token_index import CompactTokenMap
+
+
+def make_tokens(count, seed):
+    rng = random.Random(seed)
+    return ['token_%016x' % rng.getrandbits(64) for _ in range(count)]
+
+
+def build_dict(tokens, scope):
+    return {token: scope for token in tokens}
+
+
+def build_compact(tokens, scope, bloom_bits):
+    index = CompactTokenMap(len(tokens), bloom_bits_per_key=bloom_bits)
+    for token in tokens:
+        index[token] = scope
+    return index
+
+
+def measure_memory(build, count, seed):
+    """在 tracemalloc 下生成 token 并建立索引，返回 (索引, 字节数)"""
+    gc.collect()
+    tracemalloc.start()
+    tokens = make_tokens(count, seed)
+    index = build(tokens)
+    # 紧凑索引不引用原始字符串，释放后才是真实占用
+    del tokens
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return index, size
+
+
+def measure_build(build, tokens):
+    """建立索引的耗时（tracemalloc 会拖慢内存分配，单独计时）"""
+    start = time.perf_counter()
+    build(tokens)
+    return time.perf_counter() - start
+
+
+def measure_lookup(index, probes):
+    """返回每次查找的平均耗时（纳秒）"""
+    get = index.get
+    start = time.perf_counter()
+    for token in probes:
+        get(token, False)
+    return (time.perf_counter() - start) / len(probes) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description="token 索引基准测试")
+    parser.add_argument('-n', '--count', type=int, default=1000000, help="token 数量")
+    parser.add_argument('--lookups', type=int, default=200000, help="每组查找次数")
+    parser.add_argument('--bloom', type=int, default=0, help="Bloom 过滤器每个 token 的位数")
+    parser.add_argument('--seed', type=int, default=1, help="随机种子")
+    args = parser.parse_args()
+
+    scope = frozenset(['live/stream'])
+    variants = [
+        ("dict", lambda tokens: build_dict(tokens, scope)),
+        ("compact", lambda tokens: build_compact(tokens, scope, 0)),
+    ]
+    if args.bloom:
+        variants.append((f"compact+bloom{args.bloom}",
+                         lambda tokens: build_compact(tokens, scope, args.bloom)))
+
+    # 生成器相同、种子相同，各索引中的 token 完全一致
+    tokens = make_tokens(args.count, args.seed)
+    rng = random.Random(args.seed + 1)
+    hits = rng.sample(tokens, min(args.lookups, args.count))
+    misses = make_tokens(args.lookups, args.seed + 2)
+
+    print(f"token 数量: {args.count}  每组查找: {args.lookups}")
+    print(f"{'索引':<18}{'内存 (MB)':>12}{'字节/token':>12}{'建立 (s)':>10}"
+          f"{'命中 (ns)':>12}{'未命中 (ns)':>13}")
+    for name, build in variants:
+        elapsed = measure_build(build, tokens)
+        index, size = measure_memory(build, args.count, args.seed)
+        hit_ns = measure_lookup(index, hits)
+        miss_ns = measure_lookup(index, misses)
+        print(f"{name:<18}{size / 1048576:>12.1f}{size / args.count:>12.1f}{elapsed:>10.2f}"
+              f"{hit_ns:>12.0f}{miss_ns:>13.0f}")
+        del index
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
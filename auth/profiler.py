@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回调处理性能分析 - 可运行时开关的分段计时 + 慢请求日志
+
+用法（在处理函数中）:
+    trace = profiler.begin('on_play')
+    ... 解析请求 ...
+    trace.mark('parse')
+    ... 验证 token ...
+    trace.mark('token')
+    profiler.finish(trace)
+
+关闭时 begin() 直接返回共享的空对象，mark()/finish() 都是空操作。
+开启后每个请求都记录总耗时，超过阈值的写入慢请求日志；
+每 N 个请求采样一个，额外记录各阶段耗时并汇总；
+可选地对采样请求启用 cProfile，结果合并后通过管理接口导出。
+"""
+
+import cProfile
+import io
+import itertools
+import pstats
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+
+class _NullTrace:
+    """关闭分析时使用的空对象"""
+
+    __slots__ = ()
+
+    def mark(self, stage):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class _TimedTrace:
+    """未采样的请求: 只记录开始时间，用于统计总耗时和判断慢请求"""
+
+    __slots__ = ('endpoint', 'start')
+
+    stages = ()
+    profile = None
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+
+    def mark(self, stage):
+        pass
+
+
+class RequestTrace:
+    """一次采样请求的分段计时"""
+
+    __slots__ = ('endpoint', 'start', 'last', 'stages', 'profile')
+
+    def __init__(self, endpoint, profile=None):
+        self.endpoint = endpoint
+        self.start = self.last = time.perf_counter()
+        self.stages = []
+        self.profile = profile
+
+    def mark(self, stage):
+        """记录从上一个标记到现在的耗时，归入 stage"""
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+
+class Profiler:
+    """采样分析器（线程安全）"""
+
+    def __init__(self, slow_log_file=None, slow_history=100):
+        self.enabled = False
+        self.sample_every = 1
+        self.slow_ms = 50.0
+        self.use_cprofile = False
+        self.slow_log_file = slow_log_file
+
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        # 慢请求日志文件单独加锁，写文件时不阻塞其他请求的汇总
+        self._file_lock = threading.Lock()
+        # cProfile 同一时间只能有一个在运行，其他采样请求跳过 cProfile
+        self._cprofile_lock = threading.Lock()
+        self._stats = None
+        # (endpoint, stage) -> [次数, 总耗时, 最大耗时]
+        self._stages = {}
+        self._slow = deque(maxlen=slow_history)
+
+    def configure(self, enabled=None, sample_every=None, slow_ms=None, use_cprofile=None):
+        with self._lock:
+            if sample_every is not None:
+                self.sample_every = max(1, int(sample_every))
+            if slow_ms is not None:
+                self.slow_ms = float(slow_ms)
+            if use_cprofile is not None:
+                self.use_cprofile = bool(use_cprofile)
+            if enabled is not None:
+                self.enabled = bool(enabled)
+
+    def reset(self):
+        with self._lock:
+            self._stats = None
+            self._stages = {}
+            self._slow.clear()
+
+    def begin(self, endpoint):
+        if not self.enabled:
+            return NULL_TRACE
+        if next(self._counter) % self.sample_every:
+            return _TimedTrace(endpoint)
+
+        profile = None
+        if self.use_cprofile and self._cprofile_lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+            profile.enable()
+        return RequestTrace(endpoint, profile)
+
+    def finish(self, trace):
+        if trace is NULL_TRACE:
+            return
+
+        total = time.perf_counter() - trace.start
+        if trace.profile is not None:
+            trace.profile.disable()
+            self._cprofile_lock.release()
+
+        with self._lock:
+            for stage, elapsed in list(trace.stages) + [('total', total)]:
+                entry = self._stages.setdefault((trace.endpoint, stage), [0, 0.0, 0.0])
+                entry[0] += 1
+                entry[1] += elapsed
+                if elapsed > entry[2]:
+                    entry[2] = elapsed
+
+            if trace.profile is not None:
+                if self._stats is None:
+                    self._stats = pstats.Stats(trace.profile)
+                else:
+                    self._stats.add(trace.profile)
+
+        if total * 1000 >= self.slow_ms:
+            self._log_slow(trace, total)
+
+    def _log_slow(self, trace, total):
+        breakdown = ' '.join(f"{stage}={elapsed * 1000:.2f}ms" for stage, elapsed in trace.stages)
+        if not trace.stages:
+            breakdown = "(未采样，无分段耗时)"
+        entry = {
+            "time": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "endpoint": trace.endpoint,
+            "total_ms": round(total * 1000, 3),
+            "stages": {stage: round(elapsed * 1000, 3) for stage, elapsed in trace.stages},
+        }
+        with self._lock:
+            self._slow.append(entry)
+        if self.slow_log_file:
+            with self._file_lock:
+                with open(self.slow_log_file, 'a', encoding='utf-8') as f:
+                    f.write(f"[{entry['time']}] {trace.endpoint} "
+                            f"total={entry['total_ms']:.2f}ms | {breakdown}\n")
+
+    def summary(self):
+        """各阶段耗时汇总 + 最近的慢请求"""
+        with self._lock:
+            stages = {}
+            for (endpoint, stage), (count, total, peak) in self._stages.items():
+                stages.setdefault(endpoint, {})[stage] = {
+                    "count": count,
+                    "avg_ms": round(total / count * 1000, 3),
+                    "max_ms": round(peak * 1000, 3),
+                }
+            return {
+                "enabled": self.enabled,
+                "sample_every": self.sample_every,
+                "slow_ms": self.slow_ms,
+                "cprofile": self.use_cprofile,
+                "stages": stages,
+                "slow_requests": list(self._slow),
+            }
+
+    def dump_cprofile(self, sort='cumulative', limit=40):
+        """导出合并后的 cProfile 结果（文本），没有数据时返回空字符串"""
+        with self._lock:
+            if self._stats is None:
+                return ''
+            out = io.StringIO()
+            self._stats.stream = out
+            self._stats.sort_stats(sort).print_stats(limit)
+            return out.getvalue()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回调回放工具 - 把录制的真实回调流量按原始节奏重放到验证服务器
+
+用法:
+  python replay.py trace.jsonl                       # 1 倍速
+  python replay.py trace.jsonl --speed 10            # 10 倍速
+  python replay.py trace.jsonl --speed max           # 不等待，尽快发送
+  python replay.py access.log --from-log             # 从访问日志重建回调
+
+输出延迟分布，并对比录制时的 allow/deny 结果与本次结果的差异。
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# access.log 行格式（见 server.py 的 log_access）
+LOG_PATTERN = re.compile(
+    r'^\[(?P<ts>[^\]]+)\] (?P<status>✓ 允许|✗ 拒绝) \| (?P<action>[^|]+?) \| '
+    r'Token: (?P<token>[^|]*?) \| IP: (?P<ip>[^|]*?)'
+    r'(?: \| 流: (?P<stream>[^|]*?))?(?: \| 原因: (?P<reason>.*))?$'
+)
+CLIENT_PATTERN = re.compile(r'\(Client: (?P<client>[^)]*)\)')
+
+
+# ============================================================
+# 读取回调序列
+# ============================================================
+
+def load_trace(path):
+    """读取 server.py 录制的 JSON Lines 文件"""
+    events = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            events.append({
+                "t": item["t"],
+                "ep": item["ep"],
+                "d": item.get("d") or {},
+                "code": item.get("code")
+            })
+    return events
+
+
+def load_access_log(path):
+    """从 access.log 重建回调序列（时间精度为秒）"""
+    events = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            match = LOG_PATTERN.match(line.rstrip('\n'))
+            if not match:
+                continue
+
+            t = datetime.strptime(match['ts'], '%Y-%m-%d %H:%M:%S').timestamp()
+            code = 0 if match['status'].startswith('✓') else 1
+            token = match['token']
+            reason = match['reason'] or ''
+            client = CLIENT_PATTERN.search(reason)
+
+            payload = {"ip": match['ip']}
+            if client:
+                payload["client_id"] = client['client']
+            if match['stream']:
+                app, _, stream = match['stream'].partition('/')
+                payload["app"] = app
+                payload["stream"] = stream
+
+            action = match['action']
+            if action == '推流':
+                endpoint = 'on_publish'
+                payload["stream"] = reason.replace('推流到 ', '', 1)
+            elif action == '观看':
+                endpoint = 'on_play'
+                payload["param"] = '' if token == '无token' else f'?token={token}'
+            elif action == '停止':
+                endpoint = 'on_stop'
+                payload["param"] = f'?token={token}'
+            else:
+                continue
+
+            events.append({"t": t, "ep": endpoint, "d": payload, "code": code})
+    return events
+
+
+# ============================================================
+# 回放
+# ============================================================
+
+def send(url, endpoint, payload, timeout):
+    """发送一次回调，返回 (返回码, 耗时秒数)；请求失败返回码为 None"""
+    req = urllib.request.Request(
+        f"{url}/api/{endpoint}",
+        data=json.dumps(payload).encode('utf-8'),
+        headers={"Content-Type": "application/json"},
+        method='POST'
+    )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            code = json.load(resp).get('code')
+    except Exception:
+        code = None
+    return code, time.perf_counter() - start
+
+
+def replay(events, url, speed, workers, timeout):
+    """
+    按相对时间重放回调
+
+    speed 为 None 表示不等待；否则第 i 个请求在
+    start + (t_i - t_0) / speed 时刻发出，并行发送以保持节奏
+    """
+    results = [None] * len(events)
+    lags = []
+
+    def run(i, event):
+        results[i] = send(url, event["ep"], event["d"], timeout)
+
+    events = sorted(events, key=lambda e: e["t"])
+    t0 = events[0]["t"] if events else 0
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i, event in enumerate(events):
+            if speed is not None:
+                due = start + (event["t"] - t0) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                lags.append(max(0.0, time.perf_counter() - due))
+            pool.submit(run, i, event)
+
+    elapsed = time.perf_counter() - start
+    return events, results, lags, elapsed
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def report(events, results, lags, elapsed, max_diffs):
+    latencies = [r[1] for r in results if r[0] is not None]
+    failed = sum(1 for r in results if r[0] is None)
+
+    diffs = []
+    for event, (code, _) in zip(events, results):
+        if code is not None and event["code"] is not None and code != event["code"]:
+            diffs.append((event, code))
+
+    print("=" * 60)
+    print(f"请求总数: {len(events)}  失败: {failed}  用时: {elapsed:.2f}s")
+    if elapsed > 0:
+        print(f"吞吐: {len(events) / elapsed:.1f} req/s")
+    print("延迟 (ms): "
+          f"p50={percentile(latencies, 50) * 1000:.2f}  "
+          f"p90={percentile(latencies, 90) * 1000:.2f}  "
+          f"p99={percentile(latencies, 99) * 1000:.2f}  "
+          f"max={max(latencies, default=0) * 1000:.2f}")
+    if lags:
+        print(f"发送滞后 (ms): p99={percentile(lags, 99) * 1000:.2f}  "
+              f"max={max(lags) * 1000:.2f}")
+    print(f"决策差异: {len(diffs)}")
+    for event, code in diffs[:max_diffs]:
+        print(f"  {event['ep']} {json.dumps(event['d'], ensure_ascii=False)}: "
+              f"录制={event['code']} 本次={code}")
+    print("=" * 60)
+
+    return failed == 0 and not diffs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放 SRS 回调流量")
+    parser.add_argument('source', help="录制文件（JSON Lines）或 access.log")
+    parser.add_argument('--from-log', action='store_true', help="source 为 access.log")
+    parser.add_argument('--url', default='http://127.0.0.1:8080', help="验证服务器地址")
+    parser.add_argument('--speed', default='1', help="回放倍速，如 1 / 10 / max")
+    parser.add_argument('--workers', type=int, default=32, help="并发发送线程数")
+    parser.add_argument('--timeout', type=float, default=5.0, help="单个请求超时（秒）")
+    parser.add_argument('--max-diffs', type=int, default=20, help="最多打印的差异条数")
+    args = parser.parse_args()
+
+    speed = None
+    if args.speed != 'max':
+        try:
+            speed = float(args.speed)
+        except ValueError:
+            parser.error(f"--speed 应为正数或 max: {args.speed}")
+        # not > 0 同时排除 nan
+        if not speed > 0:
+            parser.error(f"--speed 必须大于 0: {args.speed}")
+
+    events = load_access_log(args.source) if args.from_log else load_trace(args.source)
+    if not events:
+        print("没有可回放的回调")
+        return 1
+
+    print(f"回放 {len(events)} 个回调 -> {args.url}（倍速: {args.speed}）")
+
+    events, results, lags, elapsed = replay(
+        events, args.url, speed, args.workers, args.timeout
+    )
+    return 0 if report(events, results, lags, elapsed, args.max_diffs) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Token 多实例同步 - 带版本号的增量日志 + 拉取线程
+
+每个实例把本地生效的每次 token 修改追加到 ChangeLog，分配单调递增的版本号。
+其他实例定期拉取 "since=上次看到的版本" 之后的增量；以下情况改为拉取
+压缩的全量快照:
+  - 对方重启过（epoch 变化，版本号从头开始）
+  - 落后太多，所需的增量已被移出日志
+
+修改是否生效由 server.py 按 (clock, node) 做"最后写入者胜出"判断，
+同一修改被转发多次也只生效一次，因此任意拓扑下都会收敛。
+"""
+
+from collections import deque
+import gzip
+import json
+import secrets
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+# 内存中保留的增量条数，落后更多的实例改拉全量快照
+CHANGELOG_SIZE = 100000
+
+# 单次拉取的最大增量条数
+PULL_BATCH = 5000
+
+
+class ChangeLog:
+    """有界的增量日志（调用方负责加锁）"""
+
+    def __init__(self, size=CHANGELOG_SIZE):
+        # 每次进程启动生成新的 epoch，对方据此判断版本号是否还能接续
+        self.epoch = secrets.token_hex(4)
+        self.version = 0
+        self._entries = deque(maxlen=size)
+
+    def append(self, token, op, streams, stamp):
+        """
+        记录一次生效的修改
+
+        op 为 '+'（添加/修改授权范围）或 '-'（删除）；stamp 为 (clock, node)
+        """
+        self.version += 1
+        self._entries.append((self.version, token, op, streams, stamp[0], stamp[1]))
+
+    def since(self, version, limit=PULL_BATCH):
+        """
+        返回 version 之后的增量 (条目列表, 是否还有更多)
+
+        所需的增量已被移出日志时返回 None（对方需要拉全量快照）
+        """
+        if version >= self.version:
+            return [], False
+        oldest = self._entries[0][0] if self._entries else self.version + 1
+        if version + 1 < oldest:
+            return None
+
+        start = version + 1 - oldest
+        end = min(start + limit, len(self._entries))
+        entries = [
+            [v, token, op, sorted(streams) if streams is not None else None, clock, node]
+            for v, token, op, streams, clock, node in (self._entries[i] for i in range(start, end))
+        ]
+        return entries, end < len(self._entries)
+
+
+def encode_snapshot(snapshot):
+    """全量快照: JSON + gzip"""
+    return gzip.compress(json.dumps(snapshot, separators=(',', ':')).encode('utf-8'))
+
+
+def decode_snapshot(data):
+    return json.loads(gzip.decompress(data).decode('utf-8'))
+
+
+class PeerPuller(threading.Thread):
+    """定期从一个对端实例拉取增量（必要时拉快照）并应用到本地"""
+
+    def __init__(self, url, admin_key, apply_changes, apply_snapshot, interval=1.0):
+        super().__init__(daemon=True)
+        self.url = url.rstrip('/')
+        self.admin_key = admin_key
+        self.apply_changes = apply_changes
+        self.apply_snapshot = apply_snapshot
+        self.interval = interval
+
+        self.epoch = ''
+        self.since = 0
+        self.last_sync = 0.0
+        self.error = ''
+
+    def _get(self, path):
+        req = urllib.request.Request(
+            self.url + path,
+            headers={"X-Admin-Key": self.admin_key()}
+        )
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            return resp.read()
+
+    def sync_once(self):
+        """拉取直到追上对端当前版本"""
+        while True:
+            query = urllib.parse.urlencode({"since": self.since, "epoch": self.epoch})
+            data = json.loads(self._get("/admin/replication/changes?" + query))
+
+            if data.get("snapshot"):
+                snapshot = decode_snapshot(self._get("/admin/replication/snapshot"))
+                self.apply_snapshot(snapshot)
+                self.epoch = snapshot["epoch"]
+                self.since = snapshot["version"]
+                continue
+
+            if data["changes"]:
+                self.apply_changes(data["changes"])
+            self.epoch = data["epoch"]
+            self.since = data["version"]
+            if not data["more"]:
+                break
+
+        self.last_sync = time.time()
+        self.error = ''
+
+    def run(self):
+        while True:
+            try:
+                self.sync_once()
+            except Exception as e:
+                self.error = str(e)
+            time.sleep(self.interval)
+
+    def status(self):
+        return {
+            "url": self.url,
+            "epoch": self.epoch,
+            "since": self.since,
+            "last_sync": self.last_sync,
+            "error": self.error,
+        }
@@ -1,20 +1,62 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
+import atexit
 import json
 import os
+import secrets
 from datetime import datetime
+from functools import wraps
 from pathlib import Path
+import select
+import signal
+import socket
+import subprocess
+import sys
 import threading
 import time
 
+from werkzeug.serving import make_server
+
+from profiler import Profiler, NULL_TRACE
+from replication import ChangeLog, PeerPuller, encode_snapshot
+from stats import ViewerStats, RESOLUTIONS
+from token_index import CompactTokenMap, TokenList, SCAN_SLOTS
+
 # ============================================================
 # 配置参数
 # ============================================================
 
-# 服务器监听端口
-SERVER_PORT = 8080
+# 服务器监听端口（同一台机器运行多个实例时用 AUTH_PORT 区分）
+SERVER_PORT = int(os.environ.get('AUTH_PORT', 8080))
+
+# Token 文件异步写盘的合并间隔（秒），期间的多次修改只写一次
+PERSIST_DELAY = 0.5
+
+# 批量修改、合并快照时每次持有锁处理的 token 数，避免长时间阻塞 on_play 的验证
+LOCK_BATCH = 2000
+
+# /admin/tokens 每页的默认数量与上限
+TOKEN_PAGE_SIZE = 1000
+TOKEN_PAGE_MAX = 10000
+
+# 回调录制文件（为空则不录制），可通过环境变量或 /admin/trace 开关
+TRACE_FILE = os.environ.get('AUTH_TRACE_FILE', '')
+# 录制内容先放在内存中，由后台线程每隔这么久（秒）合并写入一次
+TRACE_FLUSH_INTERVAL = 0.5
+
+# 平滑重启时等待新进程就绪的超时（秒）
+RESTART_READY_TIMEOUT = 15
+
+# 多实例同步: 对端地址（逗号分隔，如 http://10.0.0.2:8080）与拉取间隔（秒）
+# 各实例需使用相同的 admin_key.txt
+PEERS = [p.strip() for p in os.environ.get('AUTH_PEERS', '').split(',') if p.strip()]
+REPLICATION_INTERVAL = 1.0
+
+# token 索引前的 Bloom 过滤器每个 token 占用的位数（0 为不启用，10 时误判率约 1%）
+# 纯 Python 下哈希表探测本身就很快，过滤器通常不会更快，启用前先用 bench_tokens.py 对比
+TOKEN_BLOOM_BITS = int(os.environ.get('AUTH_TOKEN_BLOOM_BITS', 0))
 
 # ============================================================
 # 初始化
@@ -23,38 +65,779 @@ SERVER_PORT = 8080
 app = Flask(__name__)
 
 BASE_DIR = Path(__file__).parent
-TOKEN_FILE = BASE_DIR / 'valid_tokens.json'
-LOG_FILE = BASE_DIR / 'access.log'
+# 数据文件目录（同一台机器运行多个实例时用 AUTH_DATA_DIR 区分）
+DATA_DIR = Path(os.environ.get('AUTH_DATA_DIR', BASE_DIR))
+TOKEN_FILE = DATA_DIR / 'valid_tokens.json'
+REPLICATION_FILE = DATA_DIR / 'replication_state.json'
+NODE_ID_FILE = DATA_DIR / 'node_id.txt'
+LOG_FILE = DATA_DIR / 'access.log'
+SLOW_LOG_FILE = DATA_DIR / 'slow.log'
+ADMIN_KEY_FILE = DATA_DIR / 'admin_key.txt'
+PID_FILE = DATA_DIR / 'server.pid'
 
 # ============================================================
 # Token 管理
 # ============================================================
 
-def load_tokens():
-    """加载有效的 token 列表"""
-    if TOKEN_FILE.exists():
+class TokenFileError(Exception):
+    """token 文件不存在或格式错误（热加载、平滑重启时不能当作空集合处理）"""
+
+
+def load_tokens(strict=False):
+    """
+    按文件顺序加载有效的 token 及其可观看的流
+    
+    文件格式: {"token_xxx": ["live/stream", ...], "token_yyy": null}
+    null 表示可观看所有流；旧版的纯列表格式按 null 处理
+    
+    strict 为 False 时文件不存在或无法解析返回空集合（首次启动）；
+    为 True 时抛出 TokenFileError，避免把读取失败当成"吊销所有 token"
+    """
+    if not TOKEN_FILE.exists():
+        if strict:
+            raise TokenFileError(f"{TOKEN_FILE} 不存在")
+        return {}
+    try:
+        with open(TOKEN_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, list):
+            data = dict.fromkeys(data)
+        if not isinstance(data, dict):
+            raise ValueError("顶层应为对象或列表")
+        for token, streams in data.items():
+            if not isinstance(token, str) or not token:
+                raise ValueError(f"无效的 token: {token!r}")
+            if streams is not None and not (
+                    isinstance(streams, list) and all(isinstance(s, str) for s in streams)):
+                raise ValueError(f"{token} 的授权范围应为流列表或 null")
+        return data
+    except (OSError, ValueError) as e:
+        if strict:
+            raise TokenFileError(f"无法解析 {TOKEN_FILE}: {e}") from e
+        return {}
+
+
+def load_node_id():
+    """本实例的节点 ID，同步时用于区分修改来源"""
+    if NODE_ID_FILE.exists():
+        node_id = NODE_ID_FILE.read_text(encoding='utf-8').strip()
+        if node_id:
+            return node_id
+    node_id = secrets.token_hex(4)
+    NODE_ID_FILE.write_text(node_id, encoding='utf-8')
+    return node_id
+
+
+def load_replication_state():
+    """读取同步状态 (clock, {token: [clock, node]})"""
+    if REPLICATION_FILE.exists():
         try:
-            with open(TOKEN_FILE, 'r', encoding='utf-8') as f:
-                return set(json.load(f))
+            with open(REPLICATION_FILE, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            return state['clock'], {t: tuple(s) for t, s in state['stamps'].items()}
         except:
-            return set()
-    return set()
+            pass
+    return 0, {}
+
+
+# 内存中的权威 token 索引:
+#   _tokens:        token -> frozenset(可观看的流)，None 表示所有流
+#                   固定格式的 token 解码成 64 位整数存在紧凑哈希表里（见 token_index.py），
+#                   遍历顺序不再是插入顺序
+#   _stream_tokens: 流 -> 限定在该流上的 token（TokenList），键 None 对应可观看所有流的 token；
+#                   按流列出 token 时只遍历这两个列表，不扫描整个索引
+# 相同授权范围的 token 共用同一个 frozenset，百万级 token 时节省内存
+# 所有读写都在 _tokens_lock 下进行，文件只作为持久化副本
+_tokens = CompactTokenMap(bloom_bits_per_key=TOKEN_BLOOM_BITS)
+_stream_tokens = {}
+_scope_cache = {}
+_tokens_lock = threading.Lock()
+_persist_event = threading.Event()
+# 写盘线程、热加载和平滑重启都会调用 save_tokens，串行执行避免共用临时文件
+_save_lock = threading.Lock()
+
+# 多实例同步（"最后写入者胜出"）:
+#   每个 token 最后一次生效修改的逻辑时间 (clock, node) 存在 _tokens 的同一槽位里
+#   （_tokens.stamp / set_stamp）；删除后保留作为墓碑，防止旧的添加被同步回来。
+#   只出现在文件里、从未通过接口修改过的 token 没有记录
+#   _clock: Lamport 时钟，本地修改 +1，收到对端修改时取较大值
+NODE_ID = load_node_id()
+_clock, _saved_stamps = load_replication_state()
+_changelog = ChangeLog()
+REMOVED = object()
+
+
+def _intern_scope(streams):
+    """把流列表转成共享的 frozenset；None 表示所有流"""
+    if streams is None:
+        return None
+    scope = frozenset(streams)
+    return _scope_cache.setdefault(scope, scope)
+
+
+def _stream_keys(scope):
+    """授权范围在 _stream_tokens 中对应的键；False 表示 token 不存在"""
+    if scope is False:
+        return frozenset()
+    if scope is None:
+        return frozenset([None])
+    return scope
+
+
+def _update_streams(token, old, new):
+    """授权范围从 old 变为 new 时更新 流 -> token 索引（调用方持有锁）"""
+    if old == new:
+        return
+    old_keys = _stream_keys(old)
+    new_keys = _stream_keys(new)
+    for stream in old_keys - new_keys:
+        members = _stream_tokens[stream]
+        members.discard(token)
+        if not members:
+            del _stream_tokens[stream]
+    for stream in new_keys - old_keys:
+        members = _stream_tokens.get(stream)
+        if members is None:
+            members = _stream_tokens[stream] = TokenList()
+        members.add(token)
+
+
+def _index_token(token, scope):
+    """写入 token 的授权范围并更新流索引（调用方持有锁）"""
+    old = _tokens.get(token, False)
+    _tokens[token] = scope
+    _update_streams(token, old, scope)
+
+
+def _unindex_token(token):
+    """删除 token 并更新流索引（调用方持有锁）"""
+    _update_streams(token, _tokens.pop(token), False)
+
+
+def _build_index(data, stamps):
+    """用 load_tokens() 的结果和保存的同步记录整体替换内存索引"""
+    global _tokens, _stream_tokens
+    with _tokens_lock:
+        _tokens = CompactTokenMap(len(data), bloom_bits_per_key=TOKEN_BLOOM_BITS)
+        _stream_tokens = {}
+        _scope_cache.clear()
+        for token, streams in data.items():
+            _index_token(token, _intern_scope(streams))
+        for token, stamp in stamps.items():
+            _tokens.set_stamp(token, stamp)
+
+
+# 平滑重启启动的新进程必须完整加载 token，失败时不通知就绪直接退出，由旧进程继续服务
+try:
+    _build_index(load_tokens(strict='AUTH_LISTEN_FD' in os.environ), _saved_stamps)
+except TokenFileError as e:
+    print(f"✗ 加载 Token 失败，新进程退出: {e}")
+    sys.exit(1)
+del _saved_stamps
+
+
+def _next_stamp():
+    """本地修改的逻辑时间（调用方持有锁）"""
+    global _clock
+    _clock += 1
+    return (_clock, NODE_ID)
+
+
+def _write_token(token, scope, stamp):
+    """
+    按"最后写入者胜出"应用一次修改并记入增量日志（调用方持有锁）
+    
+    scope 为 REMOVED 表示删除；stamp 为 (0, '') 的修改来自对端的文件，
+    只在本地没有该 token 时添加。返回修改是否生效
+    """
+    global _clock
+    old = _tokens.stamp(token)
+    if stamp[0] == 0:
+        if token in _tokens or old is not None or scope is REMOVED:
+            return False
+    elif old is not None and old >= stamp:
+        return False
+    
+    if scope is REMOVED:
+        if token in _tokens:
+            _unindex_token(token)
+        _changelog.append(token, '-', None, stamp)
+    else:
+        _index_token(token, scope)
+        _changelog.append(token, '+', scope, stamp)
+    
+    if stamp[0]:
+        _tokens.set_stamp(token, stamp)
+        _clock = max(_clock, stamp[0])
+    return True
+
+
+def _batches(items):
+    """把 items 切成 LOCK_BATCH 大小的批次，每批单独持有一次锁"""
+    items = list(items)
+    for start in range(0, len(items), LOCK_BATCH):
+        yield items[start:start + LOCK_BATCH]
+
+
+def _reserve_tokens(extra):
+    """
+    大批量写入前预先扩容
+    
+    扩容要把所有 token 重新插入一遍（百万级需要数秒），所以在锁外对拷贝扩容，
+    再整体替换；期间索引被修改过则放弃，由写入时在锁内按需扩容
+    """
+    global _tokens
+    with _tokens_lock:
+        if not _tokens.needs_resize(extra):
+            return
+        resized = _tokens.copy()
+    resized.reserve(extra)
+    with _tokens_lock:
+        if _tokens.mutations == resized.mutations:
+            _tokens = resized
+
+
+def _scope_list(scope):
+    """授权范围 -> 可序列化的流列表（None 表示所有流）"""
+    return sorted(scope) if scope is not None else None
+
+
+def is_authorized(token, stream):
+    """检查 token 是否可观看指定的流（内存中一次哈希表探测，不读文件）"""
+    with _tokens_lock:
+        scope = _tokens.get(token, False)
+    if scope is False:
+        return False
+    return scope is None or stream in scope
+
+
+def token_count():
+    with _tokens_lock:
+        return len(_tokens)
+
+
+def list_tokens(stream=None, cursor=0, limit=TOKEN_PAGE_SIZE):
+    """
+    分页列出 token，返回 ([(token, 授权范围)], 下一页的 cursor 或 None)
+    
+    指定 stream 时只返回可观看该流的 token（从流索引中取，不扫描整个索引）。
+    每次只在锁内处理一小段，大量 token 时也不会阻塞验证请求
+    """
+    items = []
+    while cursor is not None and len(items) < limit:
+        count = min(limit - len(items), SCAN_SLOTS)
+        with _tokens_lock:
+            if stream is None:
+                batch, cursor = _tokens.scan(cursor, count)
+            else:
+                batch, cursor = _stream_page(stream, cursor, count)
+        items.extend(batch)
+    return items, cursor
+
+
+def _stream_page(stream, cursor, limit):
+    """
+    从流索引中取一段（调用方持有锁）
+    
+    先列出可观看所有流的 token（cursor >= 0 为其位置），
+    再列出限定在该流上的 token（cursor = -(位置 + 1)）
+    """
+    if cursor >= 0:
+        members = _stream_tokens.get(None)
+        tokens, position = members.slice(cursor, limit) if members else ([], None)
+        cursor = -1 if position is None else position
+    else:
+        members = _stream_tokens.get(stream)
+        tokens, position = members.slice(-cursor - 1, limit) if members else ([], None)
+        cursor = None if position is None else -(position + 1)
+    return [(token, _tokens.get(token)) for token in tokens], cursor
+
+
+def list_streams():
+    """列出所有流及限定在该流上的 token 数量"""
+    with _tokens_lock:
+        return {stream: len(members) for stream, members in _stream_tokens.items()
+                if stream is not None}
 
 
-def log_access(action, token, ip, allowed, reason=""):
+def add_tokens(tokens, streams=None):
+    """
+    批量添加 token，返回实际新增的数量
+    
+    streams 为 None 表示可观看所有流；已存在的 token 会合并授权范围
+    """
+    added = 0
+    changed = False
+    _reserve_tokens(len(tokens))
+    for batch in _batches(tokens):
+        with _tokens_lock:
+            scope = _intern_scope(streams)
+            for token in batch:
+                if token not in _tokens:
+                    _write_token(token, scope, _next_stamp())
+                    added += 1
+                    changed = True
+                    continue
+                old = _tokens[token]
+                if old is None or old == scope:
+                    continue
+                merged = None if scope is None else _intern_scope(old | scope)
+                _write_token(token, merged, _next_stamp())
+                changed = True
+    if changed:
+        _persist_event.set()
+    return added
+
+
+def remove_tokens(tokens):
+    """批量删除 token，返回实际删除的数量"""
+    removed = 0
+    for batch in _batches(tokens):
+        with _tokens_lock:
+            for token in batch:
+                if token in _tokens:
+                    _write_token(token, REMOVED, _next_stamp())
+                    removed += 1
+    if removed:
+        _persist_event.set()
+    return removed
+
+
+def save_tokens():
+    """将当前 token 集合和同步状态原子写入文件（先写临时文件再替换）"""
+    with _save_lock:
+        # 锁内只拷贝索引，序列化在锁外进行
+        with _tokens_lock:
+            tokens = _tokens.copy()
+            clock = _clock
+        snapshot = {token: _scope_list(scope) for token, scope in tokens.items()}
+        state = {"clock": clock, "stamps": {token: list(stamp) for token, stamp in tokens.stamps()}}
+
+        for path, data in ((TOKEN_FILE, snapshot), (REPLICATION_FILE, state)):
+            tmp_file = path.with_suffix('.json.tmp')
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_file, path)
+
+
+def _persist_worker():
+    """后台写盘线程：收到修改通知后稍等片刻，把多次修改合并成一次写入"""
+    while True:
+        _persist_event.wait()
+        time.sleep(PERSIST_DELAY)
+        _persist_event.clear()
+        try:
+            save_tokens()
+        except Exception as e:
+            print(f"保存 Token 文件失败: {e}")
+
+
+def _flush_tokens():
+    """退出前把未写盘的修改同步写入"""
+    if _persist_event.is_set():
+        _persist_event.clear()
+        save_tokens()
+
+
+class MutationGate:
+    """
+    平滑重启期间暂停 token 修改
+    
+    新进程在启动时从文件加载 token，之后旧进程再接受的修改不会被新进程看到，
+    还会被新进程下一次写盘覆盖。close() 等待进行中的修改完成后拒绝新的修改，
+    重启失败时 open() 恢复
+    """
+    
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._active = 0
+        self._closed = False
+    
+    def enter(self):
+        """开始一次修改，已关闭时返回 False"""
+        with self._cond:
+            if self._closed:
+                return False
+            self._active += 1
+            return True
+    
+    def exit(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+    
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.wait_for(lambda: self._active == 0)
+    
+    def open(self):
+        with self._cond:
+            self._closed = False
+
+
+_mutation_gate = MutationGate()
+
+
+def reload_tokens():
+    """
+    从文件重新加载 token（先写入尚未落盘的接口修改），返回加载后的数量
+    
+    与内存中的差异按本地修改处理，会同步给其他实例。
+    文件不存在或格式错误时抛出 TokenFileError，内存中的 token 保持不变
+    """
+    _flush_tokens()
+    data = load_tokens(strict=True)
+    
+    # 在锁外对比差异，再分批应用（应用时重新检查，期间的接口修改不会被覆盖）
+    with _tokens_lock:
+        current = _tokens.copy()
+    removed = [token for token in current if token not in data]
+    changed = [
+        (token, streams) for token, streams in data.items()
+        if current.get(token, False) != (frozenset(streams) if streams is not None else None)
+    ]
+    del current
+    
+    _reserve_tokens(len(changed))
+    for batch in _batches(removed):
+        with _tokens_lock:
+            for token in batch:
+                if token in _tokens:
+                    _write_token(token, REMOVED, _next_stamp())
+    for batch in _batches(changed):
+        with _tokens_lock:
+            for token, streams in batch:
+                scope = _intern_scope(streams)
+                if _tokens.get(token, False) != scope:
+                    _write_token(token, scope, _next_stamp())
+    _persist_event.set()
+    return token_count()
+
+
+# ============================================================
+# 多实例同步
+# ============================================================
+
+def replication_changes(since, epoch):
+    """
+    返回 since 之后的增量；对方记录的 epoch 不是本次启动的，
+    或所需增量已被移出日志时返回 None（对方应拉取全量快照）
+    """
+    with _tokens_lock:
+        if epoch != _changelog.epoch:
+            return None
+        result = _changelog.since(since)
+        if result is None:
+            return None
+        entries, more = result
+        version = entries[-1][0] if entries else _changelog.version
+        return {"epoch": _changelog.epoch, "version": version, "changes": entries, "more": more}
+
+
+def replication_snapshot():
+    """
+    全量快照: token、授权范围、逻辑时间（含墓碑）以及对应的日志版本
+    
+    锁内只拷贝索引；拷贝之后的修改版本号更大，对方会通过增量再拉取一次
+    """
+    with _tokens_lock:
+        epoch = _changelog.epoch
+        version = _changelog.version
+        tokens = _tokens.copy()
+    return {
+        "node": NODE_ID,
+        "epoch": epoch,
+        "version": version,
+        "tokens": {token: _scope_list(scope) for token, scope in tokens.items()},
+        "stamps": {token: list(stamp) for token, stamp in tokens.stamps()},
+    }
+
+
+def _gated(apply):
+    """对端同步的修改同样受 _mutation_gate 限制；暂停期间抛出异常，拉取线程稍后重试"""
+    @wraps(apply)
+    def wrapper(*args):
+        if not _mutation_gate.enter():
+            raise RuntimeError("server restarting")
+        try:
+            return apply(*args)
+        finally:
+            _mutation_gate.exit()
+    return wrapper
+
+
+def apply_remote_changes(changes):
+    """应用对端的增量 [[版本, token, '+'/'-', 流列表, clock, node], ...]（分批持有锁）"""
+    applied = 0
+    # 删除也可能插入墓碑，按条目总数预留
+    _reserve_tokens(len(changes))
+    for batch in _batches(changes):
+        with _tokens_lock:
+            for _, token, op, streams, clock, node in batch:
+                scope = REMOVED if op == '-' else _intern_scope(streams)
+                if _write_token(token, scope, (clock, node)):
+                    applied += 1
+    if applied:
+        _persist_event.set()
+    return applied
+
+
+def apply_remote_snapshot(snapshot):
+    """按 token 分批合并对端的全量快照（墓碑也参与比较）"""
+    stamps = snapshot["stamps"]
+    tokens = snapshot["tokens"]
+    applied = 0
+    tombstones = [(token, stamp) for token, stamp in stamps.items() if token not in tokens]
+    _reserve_tokens(len(tokens) + len(tombstones))
+    for batch in _batches(tokens.items()):
+        with _tokens_lock:
+            for token, streams in batch:
+                stamp = tuple(stamps.get(token, (0, '')))
+                if _write_token(token, _intern_scope(streams), stamp):
+                    applied += 1
+    for batch in _batches(tombstones):
+        with _tokens_lock:
+            for token, stamp in batch:
+                if _write_token(token, REMOVED, tuple(stamp)):
+                    applied += 1
+    if applied:
+        _persist_event.set()
+    return applied
+
+
+_peers = [
+    PeerPuller(
+        url,
+        lambda: ADMIN_KEY,
+        _gated(apply_remote_changes),
+        _gated(apply_remote_snapshot),
+        interval=REPLICATION_INTERVAL
+    )
+    for url in PEERS
+]
+
+
+# ============================================================
+# 观看统计
+# ============================================================
+
+viewer_stats = ViewerStats()
+
+
+def stream_key(data):
+    """SRS 回调中的 app/stream 组成流标识"""
+    return f"{data.get('app', 'unknown')}/{data.get('stream', 'unknown')}"
+
+
+# ============================================================
+# 回调录制（供 replay.py 回放）
+# ============================================================
+
+class TraceRecorder:
+    """
+    把收到的 SRS 回调按行写入 JSON Lines 文件
+    
+    每行: {"t": 到达时间戳, "ep": 端点名, "d": 请求体, "code": 返回码, "ms": 处理耗时}
+    回调线程只把行追加到内存缓冲区，写文件和 flush 由后台线程批量完成
+    """
+    
+    def __init__(self):
+        self._file = None
+        self._pending = []
+        # _lock 保护 _file 与 _pending；_io_lock 串行化文件写入（先取 _io_lock 再取 _lock）
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._writer = None
+    
+    @property
+    def enabled(self):
+        return self._file is not None
+    
+    def _drain(self, new_file=None, replace=False):
+        """把缓冲区写入当前文件；replace 为 True 时关闭当前文件并换成 new_file"""
+        with self._io_lock:
+            with self._lock:
+                lines, self._pending = self._pending, []
+                file = self._file
+                if replace:
+                    self._file = new_file
+            if file is None:
+                return
+            if lines:
+                file.write(''.join(lines))
+                file.flush()
+            if replace:
+                file.close()
+    
+    def _write_loop(self):
+        while True:
+            time.sleep(TRACE_FLUSH_INTERVAL)
+            try:
+                self._drain()
+            except Exception as e:
+                print(f"写入录制文件失败: {e}")
+    
+    def start(self, path):
+        self._drain(open(path, 'a', encoding='utf-8'), replace=True)
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+    
+    def stop(self):
+        self._drain(replace=True)
+    
+    def record(self, arrival, endpoint, payload, code, elapsed):
+        line = json.dumps({
+            "t": round(arrival, 6),
+            "ep": endpoint,
+            "d": payload,
+            "code": code,
+            "ms": round(elapsed * 1000, 3)
+        }, ensure_ascii=False, separators=(',', ':'))
+        with self._lock:
+            if self._file is not None:
+                self._pending.append(line + '\n')
+
+
+trace_recorder = TraceRecorder()
+if TRACE_FILE:
+    trace_recorder.start(TRACE_FILE)
+
+
+@app.before_request
+def _trace_begin():
+    g.arrival = time.time()
+
+
+@app.after_request
+def _trace_end(response):
+    if trace_recorder.enabled and request.path.startswith('/api/'):
+        result = response.get_json(silent=True) or {}
+        trace_recorder.record(
+            g.arrival,
+            request.path.rsplit('/', 1)[-1],
+            request.get_json(silent=True),
+            result.get('code'),
+            time.time() - g.arrival
+        )
+    return response
+
+
+# ============================================================
+# 性能分析（默认关闭，通过 /admin/profile 开关）
+# ============================================================
+
+profiler = Profiler(slow_log_file=SLOW_LOG_FILE)
+
+
+@app.before_request
+def _profile_begin():
+    if request.path.startswith('/api/'):
+        g.profile = profiler.begin(request.path.rsplit('/', 1)[-1])
+    else:
+        g.profile = NULL_TRACE
+
+
+@app.teardown_request
+def _profile_end(exc):
+    # teardown 在异常时也会执行，保证 cProfile 被关闭
+    trace = g.get('profile', NULL_TRACE)
+    trace.mark('response')
+    profiler.finish(trace)
+
+
+# ============================================================
+# 管理接口认证
+# ============================================================
+
+def load_admin_key():
+    """读取管理密钥，不存在则自动生成（启动器从同一文件读取）"""
+    if ADMIN_KEY_FILE.exists():
+        key = ADMIN_KEY_FILE.read_text(encoding='utf-8').strip()
+        if key:
+            return key
+    key = secrets.token_hex(16)
+    ADMIN_KEY_FILE.write_text(key, encoding='utf-8')
+    return key
+
+
+ADMIN_KEY = load_admin_key()
+
+
+def require_admin(view):
+    """管理接口装饰器：校验 X-Admin-Key 请求头"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('X-Admin-Key', '')
+        if not secrets.compare_digest(key, ADMIN_KEY):
+            return jsonify({"code": 1, "error": "unauthorized"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def refuse_while_restarting(view):
+    """修改 token 的管理接口装饰器：平滑重启期间返回 503，客户端稍后重试"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _mutation_gate.enter():
+            return jsonify({"code": 1, "error": "server restarting, retry later"}), 503
+        try:
+            return view(*args, **kwargs)
+        finally:
+            _mutation_gate.exit()
+    return wrapper
+
+
+def _request_tokens():
+    """从请求体中取出 token 列表，支持 {"token": ...} 或 {"tokens": [...]}"""
+    data = request.get_json(silent=True) or {}
+    if 'tokens' in data:
+        tokens = data['tokens']
+    elif 'token' in data:
+        tokens = [data['token']]
+    else:
+        return None
+    if not isinstance(tokens, list) or not all(isinstance(t, str) and t for t in tokens):
+        return None
+    return tokens
+
+
+def _request_streams():
+    """
+    从请求体中取出授权的流列表 {"streams": ["live/stream", ...]}
+    
+    未提供时返回 None（可观看所有流）；格式错误时返回 False
+    """
+    data = request.get_json(silent=True) or {}
+    streams = data.get('streams')
+    if streams is None:
+        return None
+    if not isinstance(streams, list) or not all(isinstance(s, str) and s for s in streams):
+        return False
+    return streams
+
+
+def log_access(action, token, ip, allowed, reason="", stream=None):
     """记录访问日志"""
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     status = "✓ 允许" if allowed else "✗ 拒绝"
     
+    log_line = f"[{timestamp}] {status} | {action} | Token: {token} | IP: {ip}"
+    if stream:
+        log_line += f" | 流: {stream}"
     if reason:
-        log_line = f"[{timestamp}] {status} | {action} | Token: {token} | IP: {ip} | 原因: {reason}\n"
-    else:
-        log_line = f"[{timestamp}] {status} | {action} | Token: {token} | IP: {ip}\n"
+        log_line += f" | 原因: {reason}"
+    log_line += "\n"
+    
+    trace = g.get('profile', NULL_TRACE)
     
     with open(LOG_FILE, 'a', encoding='utf-8') as f:
         f.write(log_line)
+    trace.mark('log_write')
     
     print(log_line.strip())
+    trace.mark('log_print')
 
 
 # ============================================================
@@ -76,11 +859,11 @@ def on_publish():
 @app.route('/api/on_play', methods=['POST'])
 def on_play():
     """
-    拉流验证 - 仅验证Token，不限制连接数
+    拉流验证 - 验证 Token 及其可观看的流，不限制连接数
     
     验证逻辑:
     1. 检查是否提供 token
-    2. 检查 token 是否有效
+    2. 检查 token 是否有效且有权观看该流（app/stream）
     3. 允许连接（不限制连接数）
     """
     data = request.json
@@ -88,23 +871,31 @@ def on_play():
     ip = data.get('ip', 'unknown')
     client_id = data.get('client_id', 'unknown')
     
+    now = time.time()
+    stream = stream_key(data)
+    g.profile.mark('parse')
+    
     # 提取 token
     if 'token=' not in param:
-        log_access('观看', '无token', ip, False, "未提供 Token")
+        viewer_stats.deny(now, ['all', f'stream:{stream}'])
+        log_access('观看', '无token', ip, False, "未提供 Token", stream)
         return jsonify({"code": 1})
     
     token = param.split('token=')[1].split('&')[0]
     
-    # 加载有效 tokens
-    valid_tokens = load_tokens()
-    
-    # 检查 token 是否有效
-    if token not in valid_tokens:
-        log_access('观看', token, ip, False, "Token 无效")
+    # 检查 token 是否可观看该流（无效 token 不单独建统计，避免被刷爆内存）
+    valid = is_authorized(token, stream)
+    g.profile.mark('token')
+    if not valid:
+        viewer_stats.deny(now, ['all', f'stream:{stream}'])
+        g.profile.mark('stats')
+        log_access('观看', token, ip, False, "Token 无效或无权观看此流", stream)
         return jsonify({"code": 1})
     
     # Token 有效，允许连接（不限制连接数）
-    log_access('观看', token, ip, True, f"连接已允许 (Client: {client_id})")
+    viewer_stats.connect(now, client_id, ['all', f'token:{token}', f'stream:{stream}'])
+    g.profile.mark('stats')
+    log_access('观看', token, ip, True, f"连接已允许 (Client: {client_id})", stream)
     
     return jsonify({"code": 0})
 
@@ -117,10 +908,12 @@ def on_stop():
     ip = data.get('ip', 'unknown')
     client_id = data.get('client_id', 'unknown')
 
+    viewer_stats.disconnect(time.time(), client_id)
+
     # 提取 token
     if 'token=' in param:
         token = param.split('token=')[1].split('&')[0]
-        log_access('停止', token, ip, True, f"连接已断开 (Client: {client_id})")
+        log_access('停止', token, ip, True, f"连接已断开 (Client: {client_id})", stream_key(data))
     
     return jsonify({"code": 0})
 
@@ -130,10 +923,405 @@ def health_check():
     """健康检查"""
     return jsonify({
         "status": "running",
-        "total_tokens": len(load_tokens())
+        "total_tokens": token_count(),
+        "pid": os.getpid()
     })
 
 
+# ============================================================
+# Token 管理接口（需要 X-Admin-Key）
+# ============================================================
+
+@app.route('/admin/tokens', methods=['GET'])
+@require_admin
+def admin_list_tokens():
+    """
+    分页列出 token
+    
+    参数:
+      stream - 只列出可观看该流（app/stream）的 token
+      scopes - 为 1 时同时返回每个 token 可观看的流
+      cursor - 上一页返回的 next_cursor（第一页为 0）
+      limit  - 每页数量（默认 TOKEN_PAGE_SIZE，最多 TOKEN_PAGE_MAX）
+    返回的 next_cursor 为 null 表示已是最后一页
+    """
+    try:
+        cursor = int(request.args.get('cursor', 0))
+        limit = int(request.args.get('limit', TOKEN_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"code": 1, "error": "invalid cursor or limit"}), 400
+    if not 1 <= limit <= TOKEN_PAGE_MAX:
+        return jsonify({"code": 1, "error": f"limit must be 1-{TOKEN_PAGE_MAX}"}), 400
+    
+    items, next_cursor = list_tokens(request.args.get('stream'), cursor, limit)
+    result = {"code": 0, "tokens": [token for token, _ in items], "next_cursor": next_cursor}
+    if request.args.get('scopes') == '1':
+        result["scopes"] = {token: _scope_list(scope) for token, scope in items}
+    return jsonify(result)
+
+
+@app.route('/admin/tokens', methods=['POST'])
+@require_admin
+@refuse_while_restarting
+def admin_add_tokens():
+    """添加 token，支持单个或批量导入；可用 streams 限定可观看的流"""
+    tokens = _request_tokens()
+    if tokens is None:
+        return jsonify({"code": 1, "error": "invalid tokens"}), 400
+    streams = _request_streams()
+    if streams is False:
+        return jsonify({"code": 1, "error": "invalid streams"}), 400
+
+    added = add_tokens(tokens, streams)
+    return jsonify({"code": 0, "added": added, "total_tokens": token_count()})
+
+
+@app.route('/admin/tokens/<token>', methods=['DELETE'])
+@require_admin
+@refuse_while_restarting
+def admin_delete_token(token):
+    """删除单个 token"""
+    removed = remove_tokens([token])
+    if not removed:
+        return jsonify({"code": 1, "error": "token not found"}), 404
+    return jsonify({"code": 0, "removed": removed, "total_tokens": token_count()})
+
+
+@app.route('/admin/tokens/revoke', methods=['POST'])
+@require_admin
+@refuse_while_restarting
+def admin_revoke_tokens():
+    """批量吊销 token"""
+    tokens = _request_tokens()
+    if tokens is None:
+        return jsonify({"code": 1, "error": "invalid tokens"}), 400
+
+    removed = remove_tokens(tokens)
+    return jsonify({"code": 0, "removed": removed, "total_tokens": token_count()})
+
+
+@app.route('/admin/replication', methods=['GET'])
+@require_admin
+def admin_replication_status():
+    """同步状态：本实例的版本与各对端的拉取进度"""
+    with _tokens_lock:
+        status = {
+            "node": NODE_ID,
+            "epoch": _changelog.epoch,
+            "version": _changelog.version,
+            "clock": _clock
+        }
+    status["peers"] = [peer.status() for peer in _peers]
+    status["code"] = 0
+    return jsonify(status)
+
+
+@app.route('/admin/replication/changes', methods=['GET'])
+@require_admin
+def admin_replication_changes():
+    """增量: ?since=对方上次看到的版本&epoch=对方记录的 epoch"""
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({"code": 1, "error": "invalid since"}), 400
+    
+    result = replication_changes(since, request.args.get('epoch', ''))
+    if result is None:
+        return jsonify({"code": 0, "snapshot": True})
+    result["code"] = 0
+    return jsonify(result)
+
+
+@app.route('/admin/replication/snapshot', methods=['GET'])
+@require_admin
+def admin_replication_snapshot():
+    """gzip 压缩的全量快照"""
+    return Response(encode_snapshot(replication_snapshot()), mimetype='application/gzip')
+
+
+@app.route('/admin/streams', methods=['GET'])
+@require_admin
+def admin_list_streams():
+    """列出所有流及限定在该流上的 token 数量"""
+    return jsonify({"code": 0, "streams": list_streams()})
+
+
+# ============================================================
+# 观看统计接口（需要 X-Admin-Key）
+# ============================================================
+
+@app.route('/admin/stats', methods=['GET'])
+@require_admin
+def admin_stats_keys():
+    """列出所有统计对象及当前在线人数"""
+    return jsonify({
+        "code": 0,
+        "resolutions": list(RESOLUTIONS),
+        "series": viewer_stats.keys()
+    })
+
+
+@app.route('/admin/stats/series', methods=['GET'])
+@require_admin
+def admin_stats_series():
+    """
+    导出某个统计对象的时间序列
+    
+    参数:
+      key        - all / token:<token> / stream:<app>/<stream>
+      resolution - 1s / 1m / 1h
+    """
+    key = request.args.get('key', 'all')
+    resolution = request.args.get('resolution', '1s')
+    
+    data = viewer_stats.export(key, resolution, time.time())
+    if data is None:
+        return jsonify({"code": 1, "error": "series not found"}), 404
+    
+    data["code"] = 0
+    return jsonify(data)
+
+
+# ============================================================
+# 回调录制开关（需要 X-Admin-Key）
+# ============================================================
+
+@app.route('/admin/trace', methods=['POST'])
+@require_admin
+def admin_trace():
+    """开始/停止录制，请求体 {"enabled": true, "file": "trace.jsonl"}"""
+    data = request.get_json(silent=True) or {}
+    if data.get('enabled'):
+        name = data.get('file', 'trace.jsonl')
+        if not isinstance(name, str) or not Path(name).name:
+            return jsonify({"code": 1, "error": "file must be a file name"}), 400
+        path = DATA_DIR / Path(name).name
+        try:
+            trace_recorder.start(path)
+        except OSError as e:
+            return jsonify({"code": 1, "error": f"cannot open {path.name}: {e}"}), 400
+        return jsonify({"code": 0, "enabled": True, "file": str(path)})
+    
+    trace_recorder.stop()
+    return jsonify({"code": 0, "enabled": False})
+
+
+# ============================================================
+# 性能分析接口（需要 X-Admin-Key）
+# ============================================================
+
+@app.route('/admin/profile', methods=['GET'])
+@require_admin
+def admin_profile_summary():
+    """各阶段耗时汇总与最近的慢请求；?format=cprofile 导出 cProfile 文本"""
+    if request.args.get('format') == 'cprofile':
+        try:
+            limit = int(request.args.get('limit', 40))
+        except ValueError:
+            return jsonify({"code": 1, "error": "invalid limit"}), 400
+        if limit < 1:
+            return jsonify({"code": 1, "error": "limit must be positive"}), 400
+        try:
+            text = profiler.dump_cprofile(sort=request.args.get('sort', 'cumulative'), limit=limit)
+        except KeyError:
+            return jsonify({"code": 1, "error": "invalid sort"}), 400
+        return text, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    
+    summary = profiler.summary()
+    summary["code"] = 0
+    return jsonify(summary)
+
+
+@app.route('/admin/profile', methods=['POST'])
+@require_admin
+def admin_profile_configure():
+    """
+    开关性能分析
+    
+    请求体（字段均可选）:
+      {"enabled": true, "sample_every": 10, "slow_ms": 50, "cprofile": false, "reset": false}
+    """
+    data = request.get_json(silent=True) or {}
+    sample_every = data.get('sample_every')
+    slow_ms = data.get('slow_ms')
+    if sample_every is not None and (
+            not isinstance(sample_every, int) or isinstance(sample_every, bool) or sample_every < 1):
+        return jsonify({"code": 1, "error": "sample_every must be a positive integer"}), 400
+    if slow_ms is not None and (
+            not isinstance(slow_ms, (int, float)) or isinstance(slow_ms, bool) or slow_ms < 0):
+        return jsonify({"code": 1, "error": "slow_ms must be a non-negative number"}), 400
+    
+    if data.get('reset'):
+        profiler.reset()
+    profiler.configure(
+        enabled=data.get('enabled'),
+        sample_every=sample_every,
+        slow_ms=slow_ms,
+        use_cprofile=data.get('cprofile')
+    )
+    
+    summary = profiler.summary()
+    return jsonify({
+        "code": 0,
+        "enabled": summary["enabled"],
+        "sample_every": summary["sample_every"],
+        "slow_ms": summary["slow_ms"],
+        "cprofile": summary["cprofile"]
+    })
+
+
+# ============================================================
+# 热加载与平滑重启
+# ============================================================
+#
+# 热加载（SIGHUP 或 POST /admin/reload）: 原地重新读取 token 文件和管理密钥
+# 平滑重启（SIGUSR2 或 POST /admin/restart，仅 Linux/Mac）:
+#   1. 新进程继承监听 socket，就绪后通过管道通知旧进程
+#   2. 旧进程停止 accept（未处理的连接留在 socket 队列里由新进程接收）
+#   3. 旧进程等待在途请求处理完毕后退出
+
+_http_server = None
+_listen_socket = None
+_restart_lock = threading.Lock()
+
+
+def reload_config():
+    """热加载 token 与管理密钥；token 文件无法加载时抛出 TokenFileError，配置保持不变"""
+    global ADMIN_KEY
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        total = reload_tokens()
+    except TokenFileError as e:
+        print(f"[{timestamp}] ✗ 重新加载失败，继续使用当前 Token: {e}")
+        raise
+    ADMIN_KEY = load_admin_key()
+    print(f"[{timestamp}] 已重新加载配置，Token 数量: {total}")
+    return total
+
+
+def _reload_on_signal():
+    """SIGHUP: 失败原因已由 reload_config 输出；平滑重启期间忽略"""
+    if not _mutation_gate.enter():
+        print("正在平滑重启，忽略 SIGHUP")
+        return
+    try:
+        reload_config()
+    except TokenFileError:
+        pass
+    finally:
+        _mutation_gate.exit()
+
+
+def graceful_restart():
+    """启动新进程接管监听 socket，成功后当前进程排空请求并退出"""
+    if not _restart_lock.acquire(blocking=False):
+        return False
+    
+    try:
+        # 等待进行中的修改完成并暂停新的修改（接口返回 503），
+        # 再把内存中的完整集合写入文件供新进程加载（文件损坏时新进程会拒绝就绪）
+        _mutation_gate.close()
+        _persist_event.clear()
+        save_tokens()
+        
+        fd = _listen_socket.fileno()
+        ready_r, ready_w = os.pipe()
+        env = dict(os.environ, AUTH_LISTEN_FD=str(fd), AUTH_READY_FD=str(ready_w))
+        child = subprocess.Popen(
+            [sys.executable, str(Path(__file__).resolve())],
+            cwd=BASE_DIR,
+            env=env,
+            pass_fds=(fd, ready_w)
+        )
+        os.close(ready_w)
+        
+        readable, _, _ = select.select([ready_r], [], [], RESTART_READY_TIMEOUT)
+        ready = bool(readable) and os.read(ready_r, 1) == b'1'
+        os.close(ready_r)
+        
+        if not ready:
+            print("✗ 新进程未能就绪，继续使用当前进程")
+            child.kill()
+            _mutation_gate.open()
+            _restart_lock.release()
+            return False
+        
+        print(f"✓ 新进程已接管 (PID: {child.pid})，当前进程处理完在途请求后退出")
+        _shutdown()
+        return True
+    except Exception as e:
+        print(f"✗ 平滑重启失败: {e}")
+        _mutation_gate.open()
+        _restart_lock.release()
+        return False
+
+
+def _shutdown():
+    """停止 accept 循环（由后台线程调用）"""
+    _http_server.shutdown()
+
+
+def _create_listen_socket():
+    """创建监听 socket；平滑重启时直接使用继承自旧进程的 socket"""
+    fd = os.environ.pop('AUTH_LISTEN_FD', None)
+    if fd is not None:
+        return socket.socket(fileno=int(fd))
+    return socket.create_server(('0.0.0.0', SERVER_PORT))
+
+
+def _notify_ready():
+    """通知旧进程：新进程已可以处理请求"""
+    fd = os.environ.pop('AUTH_READY_FD', None)
+    if fd is not None:
+        os.write(int(fd), b'1')
+        os.close(int(fd))
+
+
+def _remove_pid_file():
+    """退出时删除 pid 文件；平滑重启后文件已被新进程改写，保留不动"""
+    try:
+        if PID_FILE.read_text(encoding='utf-8').strip() == str(os.getpid()):
+            PID_FILE.unlink()
+    except OSError:
+        pass
+
+
+def _install_signal_handlers():
+    # 信号处理函数在主线程中执行，实际工作放到后台线程，避免阻塞 accept 循环
+    def in_thread(target):
+        return lambda signum, frame: threading.Thread(target=target, daemon=True).start()
+    
+    signal.signal(signal.SIGTERM, in_thread(_shutdown))
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, in_thread(_reload_on_signal))
+    if hasattr(signal, 'SIGUSR2'):
+        signal.signal(signal.SIGUSR2, in_thread(graceful_restart))
+
+
+@app.route('/admin/reload', methods=['POST'])
+@require_admin
+@refuse_while_restarting
+def admin_reload():
+    """热加载 token 文件和管理密钥（文件无法加载时返回错误，保留当前 token）"""
+    try:
+        total = reload_config()
+    except TokenFileError as e:
+        return jsonify({"code": 1, "error": str(e)}), 500
+    return jsonify({"code": 0, "total_tokens": total})
+
+
+@app.route('/admin/restart', methods=['POST'])
+@require_admin
+def admin_restart():
+    """平滑重启（新进程接管监听 socket，仅 Linux/Mac）"""
+    if not hasattr(os, 'fork'):
+        return jsonify({"code": 1, "error": "graceful restart not supported on this platform"}), 400
+    
+    # 在后台执行，本请求作为在途请求会被正常排空
+    threading.Thread(target=graceful_restart, daemon=True).start()
+    return jsonify({"code": 0})
+
+
 # ============================================================
 # 主程序
 # ============================================================
@@ -143,13 +1331,16 @@ if __name__ == '__main__':
     print("RTMP Token 验证服务器")
     print("=" * 60)
     print("功能:")
-    print("  ✓ Token 验证（必须提供有效Token）")
+    print("  ✓ Token 验证（必须提供有效Token，可限定可观看的流）")
     print("  ✓ 无连接数限制（一个Token可多人同时观看）")
     print("  ✓ 访问日志记录")
     print("=" * 60)
     print("配置:")
     print(f"  监听端口: {SERVER_PORT}")
     print("=" * 60)
+    print(f"节点 ID: {NODE_ID}")
+    print(f"同步对端: {', '.join(PEERS) if PEERS else '无'}")
+    print("=" * 60)
     print(f"Token 文件: {TOKEN_FILE}")
     print(f"日志文件: {LOG_FILE}")
     print("=" * 60)
@@ -158,7 +1349,34 @@ if __name__ == '__main__':
     print("  POST /api/on_play     - 拉流验证（不限制连接数）")
     print("  POST /api/on_stop     - 记录断开连接")
     print("  GET  /health          - 健康检查")
+    print("  *    /admin/tokens    - Token 管理（需要 X-Admin-Key）")
+    print("  GET  /admin/streams   - 流列表（需要 X-Admin-Key）")
+    print("  GET  /admin/replication - 多实例同步状态（需要 X-Admin-Key）")
+    print("  GET  /admin/stats     - 观看统计（需要 X-Admin-Key）")
+    print("  POST /admin/trace     - 回调录制开关（需要 X-Admin-Key）")
+    print("  *    /admin/profile   - 性能分析开关与结果（需要 X-Admin-Key）")
+    print("  POST /admin/reload    - 热加载 Token 与配置（需要 X-Admin-Key，或发送 SIGHUP）")
+    print("  POST /admin/restart   - 平滑重启（需要 X-Admin-Key，或发送 SIGUSR2）")
     print("=" * 60)
     print()
     
-    app.run(host='0.0.0.0', port=SERVER_PORT, debug=False)
\ No newline at end of file
+    threading.Thread(target=_persist_worker, daemon=True).start()
+    atexit.register(_flush_tokens)
+    atexit.register(trace_recorder.stop)
+    for peer in _peers:
+        peer.start()
+    
+    _listen_socket = _create_listen_socket()
+    _http_server = make_server(
+        '0.0.0.0', SERVER_PORT, app, threaded=True, fd=_listen_socket.fileno()
+    )
+    # 请求线程改为非守护线程：serve_forever 退出时 server_close 会等待
+    # 所有在途请求把响应完整写回后才返回
+    _http_server.daemon_threads = False
+    _install_signal_handlers()
+    PID_FILE.write_text(str(os.getpid()), encoding='utf-8')
+    atexit.register(_remove_pid_file)
+    _notify_ready()
+    
+    _http_server.serve_forever()
+    _listen_socket.close()
\ No newline at end of file
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+观看统计 - 固定内存的多分辨率环形缓冲区
+
+每个统计对象（全局 / 单个 Token / 单个流）保存三档分辨率:
+  1 秒 × 600   （最近 10 分钟）
+  1 分钟 × 1440（最近 1 天）
+  1 小时 × 720 （最近 30 天）
+
+每个事件只更新三档中当前时间对应的一个槽位，复杂度 O(1)；
+槽位数组在创建时一次性分配，运行多久内存都不会增长。
+统计对象和在线会话的数量都有上限，token 再多内存也不会增长。
+"""
+
+from array import array
+from collections import OrderedDict
+import threading
+
+# (分辨率秒数, 槽位数)
+RESOLUTIONS = {
+    '1s': (1, 600),
+    '1m': (60, 1440),
+    '1h': (3600, 720),
+}
+
+# 最多保留的统计对象数量，超出时淘汰当前无人观看且最久未更新的；
+# 都有人在观看时新的对象计入 OVERFLOW_KEY
+MAX_SERIES = 1000
+OVERFLOW_KEY = 'overflow'
+
+# 最多记录的在线会话数；on_stop 丢失（如 SRS 重启）的会话不会自行消失，
+# 超出时把最早连接的会话当作已断开
+MAX_SESSIONS = 100000
+
+
+class RingSeries:
+    """单一分辨率的环形缓冲区"""
+
+    def __init__(self, resolution, size):
+        self.resolution = resolution
+        self.size = size
+        # stamps[i] 记录槽位 i 当前属于哪个时间桶，-1 表示空
+        self.stamps = array('q', [-1]) * size
+        # viewers 为桶内峰值，closing 为桶结束时的在线人数（用于填补空桶）
+        self.viewers = array('i', [0]) * size
+        self.closing = array('i', [0]) * size
+        self.connects = array('i', [0]) * size
+        self.denies = array('i', [0]) * size
+
+    def _slot(self, now):
+        bucket = int(now // self.resolution)
+        i = bucket % self.size
+        if self.stamps[i] != bucket:
+            # 槽位属于过期的时间桶，复用前清零
+            self.stamps[i] = bucket
+            self.viewers[i] = 0
+            self.closing[i] = 0
+            self.connects[i] = 0
+            self.denies[i] = 0
+        return i
+
+    def record(self, now, viewers, connects=0, denies=0):
+        i = self._slot(now)
+        # 在线人数取桶内峰值
+        if viewers > self.viewers[i]:
+            self.viewers[i] = viewers
+        self.closing[i] = viewers
+        self.connects[i] += connects
+        self.denies[i] += denies
+
+    def export(self, now, current_viewers):
+        """按时间顺序导出整个窗口（列式，便于压缩传输）
+
+        没有事件的桶：在线人数沿用上一个桶结束时的值，连接/拒绝数为 0
+        """
+        last_bucket = int(now // self.resolution)
+        first_bucket = last_bucket - self.size + 1
+
+        viewers = []
+        connects = []
+        denies = []
+        carry = None
+        for bucket in range(first_bucket, last_bucket + 1):
+            i = bucket % self.size
+            if self.stamps[i] == bucket:
+                viewers.append(self.viewers[i])
+                carry = self.closing[i]
+                connects.append(self.connects[i])
+                denies.append(self.denies[i])
+            else:
+                viewers.append(carry)
+                connects.append(0)
+                denies.append(0)
+
+        # 窗口开头尚无记录的部分用首个已知值回填，全部未知则用当前值
+        first_known = next((v for v in viewers if v is not None), current_viewers)
+        viewers = [first_known if v is None else v for v in viewers]
+
+        return {
+            "resolution": self.resolution,
+            "start": first_bucket * self.resolution,
+            "viewers": viewers,
+            "connects": connects,
+            "denies": denies,
+        }
+
+
+class ViewerSeries:
+    """一个统计对象的当前在线人数 + 全部分辨率的历史"""
+
+    def __init__(self):
+        self.current = 0
+        self.updated = 0.0
+        self.levels = {
+            name: RingSeries(resolution, size)
+            for name, (resolution, size) in RESOLUTIONS.items()
+        }
+
+    def record(self, now, delta=0, connects=0, denies=0):
+        self.current = max(0, self.current + delta)
+        self.updated = now
+        for level in self.levels.values():
+            level.record(now, self.current, connects, denies)
+
+
+class ViewerStats:
+    """按 key 管理的统计对象集合（线程安全）
+
+    key 约定: "all" / "token:<token>" / "stream:<app>/<stream>"，
+    超出 max_series 的对象合并计入 "overflow"
+    """
+
+    def __init__(self, max_series=MAX_SERIES, max_sessions=MAX_SESSIONS):
+        self.max_series = max_series
+        self.max_sessions = max_sessions
+        self._series = {'all': ViewerSeries(), OVERFLOW_KEY: ViewerSeries()}
+        # 当前无人观看、可被淘汰的 key，按最近更新时间排列（最久未更新的在前）
+        self._idle = OrderedDict()
+        # client_id -> 连接时实际计入的 keys，断开时据此减少在线人数（按连接先后排列）
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _resolve(self, key):
+        """key 对应的统计对象；已满且没有可淘汰的对象时计入 OVERFLOW_KEY"""
+        if key in self._series:
+            return key
+        if len(self._series) >= self.max_series and not self._evict():
+            return OVERFLOW_KEY
+        self._series[key] = ViewerSeries()
+        return key
+
+    def _evict(self):
+        if not self._idle:
+            return False
+        key, _ = self._idle.popitem(last=False)
+        del self._series[key]
+        return True
+
+    def _update(self, now, key, series, delta=0, connects=0, denies=0):
+        """更新统计对象，并按更新后的在线人数加入或移出可淘汰队列"""
+        series.record(now, delta, connects, denies)
+        if key in ('all', OVERFLOW_KEY):
+            return
+        if series.current == 0:
+            self._idle[key] = None
+            self._idle.move_to_end(key)
+        else:
+            self._idle.pop(key, None)
+
+    def _record(self, now, keys, delta=0, connects=0, denies=0):
+        """记录到 keys 对应的统计对象，返回实际计入的 keys（去重）"""
+        resolved = list(dict.fromkeys(self._resolve(key) for key in keys))
+        for key in resolved:
+            self._update(now, key, self._series[key], delta, connects, denies)
+        return resolved
+
+    def _release(self, now, keys):
+        """会话结束：减少在线人数（统计对象已被淘汰的跳过）"""
+        for key in keys:
+            series = self._series.get(key)
+            if series is not None:
+                self._update(now, key, series, -1)
+
+    def connect(self, now, client_id, keys):
+        """观看者连接成功：在线人数 +1，连接数 +1"""
+        with self._lock:
+            if client_id in self._sessions:
+                # 同一客户端重复回调，只计连接次数
+                self._record(now, keys, connects=1)
+                return
+            if len(self._sessions) >= self.max_sessions:
+                _, oldest = self._sessions.popitem(last=False)
+                self._release(now, oldest)
+            self._sessions[client_id] = self._record(now, keys, delta=1, connects=1)
+
+    def disconnect(self, now, client_id):
+        """观看者断开：在线人数 -1（未知的 client_id 忽略）"""
+        with self._lock:
+            keys = self._sessions.pop(client_id, None)
+            if keys is not None:
+                self._release(now, keys)
+
+    def deny(self, now, keys):
+        """连接被拒绝：拒绝数 +1"""
+        with self._lock:
+            self._record(now, keys, denies=1)
+
+    def keys(self):
+        with self._lock:
+            return {k: s.current for k, s in self._series.items()}
+
+    def export(self, key, resolution, now):
+        """导出某个 key 在某档分辨率下的数据，不存在时返回 None"""
+        with self._lock:
+            series = self._series.get(key)
+            if series is None or resolution not in series.levels:
+                return None
+            data = series.levels[resolution].export(now, series.current)
+            data["key"] = key
+            data["current"] = series.current
+            return data
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多实例同步测试 - 在空闲端口上启动 3 个互为对端的 server.py，检查 token 最终一致
+
+用法:
+  python -m pytest test_replication.py
+
+依次检查: 批量添加后一致；两个实例同时添加/删除同一个 token 后一致；
+一个实例停机期间其他实例继续修改，它重启（新 epoch，对端改拉全量快照）后一致。
+"""
+
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from test_restart import (
+    free_port, request, wait_until, start_server, wait_healthy, stop_server, list_all_tokens
+)
+
+ADMIN_KEY = 'replication-test-key'
+NODES = 3
+CONVERGE_TIMEOUT = 20
+
+
+class Cluster:
+    """全互联的若干个实例，共用同一个管理密钥"""
+
+    def __init__(self, root, count):
+        self.dirs = [root / f'node{i}' for i in range(count)]
+        self.ports = [free_port() for _ in range(count)]
+        self.urls = [f'http://127.0.0.1:{port}' for port in self.ports]
+        self.servers = [None] * count
+        for data_dir in self.dirs:
+            data_dir.mkdir()
+            (data_dir / 'admin_key.txt').write_text(ADMIN_KEY, encoding='utf-8')
+
+    def start(self, i):
+        peers = [url for j, url in enumerate(self.urls) if j != i]
+        self.servers[i] = start_server(self.dirs[i], self.ports[i], peers)
+        wait_healthy(self.urls[i])
+
+    def stop(self, i):
+        if self.servers[i] is not None:
+            stop_server(self.servers[i], self.dirs[i])
+            self.servers[i] = None
+
+    def call(self, i, path, payload=None, method='POST'):
+        status, result = request(self.urls[i], path, payload, ADMIN_KEY, method)
+        assert status == 200 and result.get('code') == 0, result
+        return result
+
+    def tokens(self, i, stream=None):
+        return list_all_tokens(self.urls[i], ADMIN_KEY, stream)
+
+    def snapshot(self, stream=None):
+        return [self.tokens(i, stream) for i in range(len(self.urls))]
+
+    def converged(self, expected=None, stream=None):
+        states = self.snapshot(stream)
+        if expected is not None:
+            return all(state == expected for state in states)
+        return all(state == states[0] for state in states)
+
+
+@pytest.fixture
+def cluster():
+    with tempfile.TemporaryDirectory(prefix='auth-replication-') as tmp:
+        nodes = Cluster(Path(tmp), NODES)
+        try:
+            for i in range(NODES):
+                nodes.start(i)
+            yield nodes
+        finally:
+            for i in range(NODES):
+                nodes.stop(i)
+
+
+def token_range(start, stop):
+    return ['token_%016x' % i for i in range(start, stop)]
+
+
+def test_bulk_conflict_and_restart(cluster):
+    # 批量添加：一个实例上的修改到达所有实例
+    bulk = token_range(0, 3000)
+    cluster.call(0, '/admin/tokens', {"tokens": bulk, "streams": ["live/a"]})
+    unscoped = set(token_range(10000, 10010))
+    cluster.call(1, '/admin/tokens', {"tokens": sorted(unscoped)})
+    expected = set(bulk) | unscoped
+    assert wait_until(lambda: cluster.converged(expected), CONVERGE_TIMEOUT)
+    # 未限定流的 token 可观看所有流
+    assert cluster.converged(unscoped, 'live/b')
+
+    # 冲突：两个实例几乎同时删除/重新添加同一个 token，最后写入者胜出，各实例结果相同
+    contested = bulk[0]
+    cluster.call(1, f'/admin/tokens/{contested}', method='DELETE')
+    cluster.call(2, '/admin/tokens', {"token": contested, "streams": ["live/b"]})
+    # 添加已存在的 token 会合并授权范围，所以胜出的可能是 live/b 或 live/a + live/b
+    assert wait_until(lambda: all(cluster.converged(stream=s) for s in (None, 'live/a', 'live/b')),
+                      CONVERGE_TIMEOUT)
+    if contested in cluster.tokens(0):
+        assert cluster.tokens(0, 'live/b') == unscoped | {contested}
+    else:
+        expected.discard(contested)
+        assert cluster.tokens(0, 'live/b') == unscoped
+
+    # 重启：停机期间的添加和吊销在重启后通过全量快照追上
+    old_epoch = cluster.call(2, '/admin/replication', method='GET')["epoch"]
+    cluster.stop(2)
+    added = token_range(20000, 20500)
+    revoked = bulk[1:501]
+    cluster.call(0, '/admin/tokens', {"tokens": added})
+    cluster.call(1, '/admin/tokens/revoke', {"tokens": revoked})
+    expected = (expected | set(added)) - set(revoked)
+    cluster.start(2)
+    new_epoch = cluster.call(2, '/admin/replication', method='GET')["epoch"]
+    assert new_epoch != old_epoch
+    assert wait_until(lambda: cluster.converged(expected), CONVERGE_TIMEOUT)
+
+    # 其他实例发现新 epoch 后改拉快照，之后重启的实例上的修改也能同步出去
+    def peers_follow_new_epoch():
+        for i in (0, 1):
+            peers = cluster.call(i, '/admin/replication', method='GET')["peers"]
+            status = next(p for p in peers if p["url"] == cluster.urls[2])
+            if status["epoch"] != new_epoch:
+                return False
+        return True
+    assert wait_until(peers_follow_new_epoch, CONVERGE_TIMEOUT)
+
+    late = token_range(30000, 30010)
+    cluster.call(2, '/admin/tokens', {"tokens": late})
+    cluster.call(2, '/admin/tokens/revoke', {"tokens": bulk[501:511]})
+    expected = (expected | set(late)) - set(bulk[501:511])
+    assert wait_until(lambda: cluster.converged(expected), CONVERGE_TIMEOUT)
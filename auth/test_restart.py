@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+平滑重启测试 - 持续压测 on_play 的同时多次发送 SIGUSR2，要求零失败（仅 Linux/Mac）
+
+用法:
+  python test_restart.py                        # 8 个线程，重启 3 次
+  python test_restart.py --threads 16 --restarts 5
+  python -m pytest test_restart.py              # 同样的检查，参数较小
+
+在临时目录和空闲端口上启动一个独立的 server.py，不影响正在运行的实例。
+同时有一个线程通过管理接口持续添加 token，检查已确认的添加在重启后都还在
+（重启期间返回 503 的添加不算确认）。
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+SERVER = Path(__file__).parent / 'server.py'
+TOKEN = 'token_00000000000000ff'
+STREAM = {"app": "live", "stream": "stream"}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def request(url, path, payload=None, admin_key=None, method='POST', timeout=5):
+    """返回 (HTTP 状态码, 响应 JSON)"""
+    headers = {"Content-Type": "application/json"}
+    if admin_key:
+        headers["X-Admin-Key"] = admin_key
+    req = urllib.request.Request(
+        url + path,
+        data=json.dumps(payload).encode('utf-8') if payload is not None else None,
+        headers=headers,
+        method=method
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, json.load(resp)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def read_pid(data_dir):
+    try:
+        return int((data_dir / 'server.pid').read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def wait_until(check, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if check():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def start_server(data_dir, port, peers=()):
+    """在 data_dir 和 port 上启动一个独立的 server.py，返回子进程"""
+    env = dict(os.environ, AUTH_PORT=str(port), AUTH_DATA_DIR=str(data_dir),
+               AUTH_PEERS=','.join(peers))
+    env.pop('AUTH_TRACE_FILE', None)
+    return subprocess.Popen(
+        [sys.executable, str(SERVER)],
+        cwd=SERVER.parent,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+
+def wait_healthy(url, timeout=15):
+    def healthy():
+        try:
+            return request(url, '/health', method='GET', timeout=1)[0] == 200
+        except OSError:
+            return False
+    if not wait_until(healthy, timeout):
+        raise RuntimeError(f"验证服务器未能启动: {url}")
+
+
+def stop_server(server, data_dir):
+    """停止 server 以及平滑重启后接管的进程"""
+    pid = read_pid(data_dir)
+    if pid is not None and pid != server.pid:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+    server.terminate()
+    server.wait()
+    # 接管的进程不是本进程的子进程，等它退出后再删除数据目录
+    wait_until(lambda: read_pid(data_dir) is None or not pid_alive(read_pid(data_dir)), 10)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def list_all_tokens(url, admin_key, stream=None):
+    """分页取出全部 token（给出 stream 时只取可观看该流的）"""
+    tokens = set()
+    cursor = 0
+    query = f'&stream={stream}' if stream else ''
+    while cursor is not None:
+        _, result = request(url, f'/admin/tokens?limit=10000&cursor={cursor}{query}',
+                            admin_key=admin_key, method='GET')
+        tokens.update(result["tokens"])
+        cursor = result["next_cursor"]
+    return tokens
+
+
+def run(threads=8, restarts=3, interval=2.0):
+    """返回 (成功的 on_play 数, 失败的 on_play 数, 丢失的已确认添加数)"""
+    with tempfile.TemporaryDirectory(prefix='auth-restart-') as tmp:
+        return _run(Path(tmp), threads, restarts, interval)
+
+
+def _run(data_dir, threads, restarts, interval):
+    (data_dir / 'valid_tokens.json').write_text(json.dumps({TOKEN: None}), encoding='utf-8')
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    server = start_server(data_dir, port)
+
+    try:
+        wait_healthy(url)
+        admin_key = (data_dir / 'admin_key.txt').read_text(encoding='utf-8').strip()
+
+        stop = threading.Event()
+        counts = {"ok": 0, "failed": 0}
+        counts_lock = threading.Lock()
+        acked = []
+
+        def player(n):
+            i = 0
+            while not stop.is_set():
+                payload = dict(STREAM, param=f'?token={TOKEN}', client_id=f'{n}-{i}', ip='127.0.0.1')
+                i += 1
+                try:
+                    ok = request(url, '/api/on_play', payload)[1].get('code') == 0
+                except Exception:
+                    ok = False
+                with counts_lock:
+                    counts["ok" if ok else "failed"] += 1
+
+        def writer():
+            i = 0
+            while not stop.is_set():
+                token = 'token_%016x' % i
+                i += 1
+                try:
+                    status, result = request(url, '/admin/tokens', {"token": token}, admin_key)
+                except Exception:
+                    continue
+                if status == 200 and result.get('code') == 0:
+                    acked.append(token)
+
+        workers = [threading.Thread(target=player, args=(n,)) for n in range(threads)]
+        workers.append(threading.Thread(target=writer))
+        for worker in workers:
+            worker.start()
+
+        for _ in range(restarts):
+            time.sleep(interval)
+            pid = read_pid(data_dir)
+            os.kill(pid, signal.SIGUSR2)
+            if not wait_until(lambda: read_pid(data_dir) not in (None, pid), 15):
+                raise RuntimeError("新进程未能接管")
+        time.sleep(interval)
+
+        stop.set()
+        for worker in workers:
+            worker.join()
+
+        listed = list_all_tokens(url, admin_key)
+        lost = sum(1 for token in acked if token not in listed)
+        return counts["ok"], counts["failed"], lost
+    finally:
+        stop_server(server, data_dir)
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGUSR2'), reason="平滑重启仅支持 Linux/Mac")
+def test_graceful_restart():
+    ok, failed, lost = run(threads=4, restarts=3, interval=1.0)
+    assert ok > 0
+    assert failed == 0
+    assert lost == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="平滑重启零失败测试")
+    parser.add_argument('--threads', type=int, default=8, help="并发 on_play 线程数")
+    parser.add_argument('--restarts', type=int, default=3, help="重启次数")
+    parser.add_argument('--interval', type=float, default=2.0, help="两次重启之间的间隔（秒）")
+    args = parser.parse_args()
+
+    if not hasattr(signal, 'SIGUSR2'):
+        print("平滑重启仅支持 Linux/Mac")
+        return 1
+
+    ok, failed, lost = run(args.threads, args.restarts, args.interval)
+    print(f"on_play 成功: {ok}  失败: {failed}  丢失的已确认添加: {lost}")
+    return 0 if ok and not failed and not lost else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
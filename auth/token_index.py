@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+紧凑的 token 索引 - 用于百万级以上 token 的部署
+
+启动器生成的 token 格式固定为 "token_" + 16 位小写十六进制，
+可以无损解码成一个 64 位整数。CompactTokenMap 把这类 token 存进
+开放寻址哈希表（线性探测）:
+  keys    array('Q')  64 位整数
+  states  array('B')  槽位状态: 空 / 使用中 / 已删除 / 已吊销
+  values  array('I')  授权范围编号（相同范围的 token 共用一个 frozenset）
+  clocks  array('Q')  多实例同步的逻辑时间，0 表示没有记录
+  nodes   array('H')  修改来源的节点编号
+每个 token 约 23 字节 / 负载因子，而 str + set + 同步记录需要 200 字节以上。
+不符合固定格式的 token 放在普通 dict 里，对外表现为一个普通映射:
+  token -> frozenset(可观看的流)，None 表示所有流
+
+同步记录 (clock, node) 与 token 存在同一个槽位里；带同步记录的 token
+被删除后槽位保留为"已吊销"（同步用的墓碑），不算在映射里。
+
+可选的 Bloom 过滤器在探测哈希表之前拒绝大部分未知 token（默认不启用）。
+
+TokenList 是同样编码的 token 列表，用于 流 -> token 的索引，每个 token 8 字节。
+"""
+
+from array import array
+import itertools
+
+TOKEN_PREFIX = 'token_'
+TOKEN_LENGTH = len(TOKEN_PREFIX) + 16
+
+EMPTY = 0
+USED = 1
+DELETED = 2
+# 已删除但保留同步记录的 token（墓碑），占用槽位，查找时视为不存在
+REVOKED = 3
+
+MAX_LOAD = 0.7
+MIN_CAPACITY = 1024
+
+M64 = (1 << 64) - 1
+# Fibonacci 哈希，避免批量导入的连续 token 聚集在相邻槽位
+GOLDEN = 0x9E3779B97F4A7C15
+BLOOM_STEP = 0xC2B2AE3D27D4EB4F
+BLOOM_HASHES = 3
+
+# scan() 每次调用最多检查的槽位数
+SCAN_SLOTS = 4096
+
+
+def encode_token(token):
+    """token_<16 位小写十六进制> -> 64 位整数；其他格式返回 None"""
+    if len(token) != TOKEN_LENGTH or not token.startswith(TOKEN_PREFIX):
+        return None
+    hex_part = token[len(TOKEN_PREFIX):]
+    try:
+        key = int(hex_part, 16)
+    except ValueError:
+        return None
+    # int() 也接受大写、下划线等写法，回转一次确认格式完全一致
+    if '%016x' % key != hex_part:
+        return None
+    return key
+
+
+def decode_token(key):
+    return '%s%016x' % (TOKEN_PREFIX, key)
+
+
+class CompactTokenMap:
+    """token -> 授权范围 的紧凑映射（非线程安全，调用方加锁）"""
+
+    def __init__(self, expected=0, bloom_bits_per_key=0):
+        self.bloom_bits_per_key = bloom_bits_per_key
+        self._other = {}
+        # 编号 0 固定表示 None（所有流）
+        self._scope_list = [None]
+        self._scope_ids = {}
+        # 节点编号 -> 节点 ID，编号 0 对应没有同步记录时的 ''
+        self._node_list = ['']
+        self._node_ids = {'': 0}
+        # 兜底 dict 中 token 的同步记录（含墓碑）
+        self._other_stamps = {}
+        # 修改计数，用于判断锁外重建期间映射是否被修改过
+        self.mutations = 0
+        self._allocate(self._capacity_for(expected))
+
+    # ------------------------------------------------------------
+    # 哈希表
+    # ------------------------------------------------------------
+
+    @staticmethod
+    def _capacity_for(count):
+        capacity = MIN_CAPACITY
+        while capacity * MAX_LOAD < count:
+            capacity *= 2
+        return capacity
+
+    def _allocate(self, capacity):
+        self._capacity = capacity
+        self._mask = capacity - 1
+        self._shift = 64 - capacity.bit_length() + 1
+        self._keys = array('Q', bytes(8 * capacity))
+        self._states = array('B', bytes(capacity))
+        self._values = array('I', bytes(4 * capacity))
+        self._clocks = array('Q', bytes(8 * capacity))
+        self._nodes = array('H', bytes(2 * capacity))
+        self._used = 0
+        self._revoked = 0
+        self._deleted = 0
+        self._bloom = None
+        if self.bloom_bits_per_key:
+            self._bloom_bits = max(64, int(capacity * MAX_LOAD * self.bloom_bits_per_key))
+            self._bloom = bytearray((self._bloom_bits + 7) // 8)
+
+    def _slot(self, key):
+        return ((key * GOLDEN) & M64) >> self._shift
+
+    def _find(self, key):
+        """返回 key 所在槽位，不存在时返回 -1"""
+        states = self._states
+        keys = self._keys
+        mask = self._mask
+        i = self._slot(key)
+        while True:
+            state = states[i]
+            if state == EMPTY:
+                return -1
+            if state == USED and keys[i] == key:
+                return i
+            i = (i + 1) & mask
+
+    def _locate(self, key):
+        """返回 key 所在槽位（使用中或已吊销），不存在时返回 -1"""
+        states = self._states
+        keys = self._keys
+        mask = self._mask
+        i = self._slot(key)
+        while True:
+            state = states[i]
+            if state == EMPTY:
+                return -1
+            if state != DELETED and keys[i] == key:
+                return i
+            i = (i + 1) & mask
+
+    def _insert(self, key, value, state=USED):
+        """插入或覆盖，返回所在槽位；已吊销的槽位重新使用时保留同步记录"""
+        states = self._states
+        keys = self._keys
+        mask = self._mask
+        i = self._slot(key)
+        free = -1
+        while True:
+            current = states[i]
+            if current == EMPTY:
+                break
+            if current == DELETED:
+                if free < 0:
+                    free = i
+            elif keys[i] == key:
+                if current != state:
+                    self._count_state(current, -1)
+                    self._count_state(state, 1)
+                    states[i] = state
+                self._values[i] = value
+                return i
+            i = (i + 1) & mask
+
+        if free >= 0:
+            i = free
+            self._deleted -= 1
+        states[i] = state
+        keys[i] = key
+        self._values[i] = value
+        self._clocks[i] = 0
+        self._nodes[i] = 0
+        self._count_state(state, 1)
+        self._bloom_add(key)
+
+        if self._used + self._revoked + self._deleted > self._capacity * MAX_LOAD:
+            self._rebuild(self._capacity_for((self._used + self._revoked) * 2))
+            i = self._locate(key)
+        return i
+
+    def _count_state(self, state, delta):
+        if state == USED:
+            self._used += delta
+        else:
+            self._revoked += delta
+
+    def _rebuild(self, capacity):
+        """按新容量重新插入所有 token 和墓碑（已删除槽位较多时也可按原大小重建）"""
+        states = self._states
+        old = [(self._keys[i], self._values[i], states[i], self._clocks[i], self._nodes[i])
+               for i in range(self._capacity) if states[i] == USED or states[i] == REVOKED]
+        self._allocate(capacity)
+        for key, value, state, clock, node in old:
+            i = self._insert(key, value, state)
+            self._clocks[i] = clock
+            self._nodes[i] = node
+
+    def needs_resize(self, extra):
+        """再插入 extra 个 token 是否会触发扩容"""
+        return self._used + self._revoked + self._deleted + extra > self._capacity * MAX_LOAD
+
+    def reserve(self, extra):
+        """预先扩容到能再容纳 extra 个 token（通常对 copy() 的结果在锁外调用）"""
+        capacity = self._capacity_for(self._used + self._revoked + extra)
+        if capacity > self._capacity:
+            self._rebuild(capacity)
+
+    # ------------------------------------------------------------
+    # Bloom 过滤器
+    # ------------------------------------------------------------
+
+    def _bloom_add(self, key):
+        if self._bloom is not None:
+            bloom = self._bloom
+            bits = self._bloom_bits
+            pos = (key * GOLDEN) & M64
+            step = ((key * BLOOM_STEP) & M64) | 1
+            for _ in range(BLOOM_HASHES):
+                bit = pos % bits
+                bloom[bit >> 3] |= 1 << (bit & 7)
+                pos += step
+
+    def _bloom_maybe(self, key):
+        """key 一定不存在时返回 False（双重哈希生成 BLOOM_HASHES 个位置）"""
+        bloom = self._bloom
+        bits = self._bloom_bits
+        pos = (key * GOLDEN) & M64
+        step = ((key * BLOOM_STEP) & M64) | 1
+        for _ in range(BLOOM_HASHES):
+            bit = pos % bits
+            if not bloom[bit >> 3] >> (bit & 7) & 1:
+                return False
+            pos += step
+        return True
+
+    # ------------------------------------------------------------
+    # 授权范围编号
+    # ------------------------------------------------------------
+
+    def _scope_id(self, scope):
+        if scope is None:
+            return 0
+        scope_id = self._scope_ids.get(scope)
+        if scope_id is None:
+            scope_id = len(self._scope_list)
+            self._scope_list.append(scope)
+            self._scope_ids[scope] = scope_id
+        return scope_id
+
+    # ------------------------------------------------------------
+    # 同步记录
+    # ------------------------------------------------------------
+
+    def _node_id(self, node):
+        node_id = self._node_ids.get(node)
+        if node_id is None:
+            node_id = len(self._node_list)
+            self._node_list.append(node)
+            self._node_ids[node] = node_id
+        return node_id
+
+    def stamp(self, token):
+        """token 最后一次生效修改的 (clock, node)（已删除的 token 也保留），没有记录时返回 None"""
+        key = encode_token(token)
+        if key is None:
+            return self._other_stamps.get(token)
+        i = self._locate(key)
+        if i < 0 or not self._clocks[i]:
+            return None
+        return (self._clocks[i], self._node_list[self._nodes[i]])
+
+    def set_stamp(self, token, stamp):
+        """记录 token 的同步时间；token 不在映射里时记为墓碑"""
+        self.mutations += 1
+        key = encode_token(token)
+        if key is None:
+            self._other_stamps[token] = stamp
+            return
+        i = self._locate(key)
+        if i < 0:
+            i = self._insert(key, 0, REVOKED)
+        self._clocks[i] = stamp[0]
+        self._nodes[i] = self._node_id(stamp[1])
+
+    def stamps(self):
+        """遍历所有同步记录 (token, (clock, node))，包括墓碑"""
+        for token, stamp in list(self._other_stamps.items()):
+            yield token, stamp
+        states = self._states
+        keys = self._keys
+        clocks = self._clocks
+        nodes = self._nodes
+        node_list = self._node_list
+        for i in range(self._capacity):
+            if clocks[i] and (states[i] == USED or states[i] == REVOKED):
+                yield decode_token(keys[i]), (clocks[i], node_list[nodes[i]])
+
+    # ------------------------------------------------------------
+    # 映射接口
+    # ------------------------------------------------------------
+
+    def get(self, token, default=None):
+        key = encode_token(token)
+        if key is None:
+            return self._other.get(token, default)
+        if self._bloom is not None and not self._bloom_maybe(key):
+            return default
+        i = self._find(key)
+        if i < 0:
+            return default
+        return self._scope_list[self._values[i]]
+
+    def __contains__(self, token):
+        key = encode_token(token)
+        if key is None:
+            return token in self._other
+        if self._bloom is not None and not self._bloom_maybe(key):
+            return False
+        return self._find(key) >= 0
+
+    def __getitem__(self, token):
+        missing = object()
+        scope = self.get(token, missing)
+        if scope is missing:
+            raise KeyError(token)
+        return scope
+
+    def __setitem__(self, token, scope):
+        key = encode_token(token)
+        self.mutations += 1
+        if key is None:
+            self._other[token] = scope
+        else:
+            self._insert(key, self._scope_id(scope))
+
+    def pop(self, token):
+        key = encode_token(token)
+        if key is None:
+            scope = self._other.pop(token)
+            self.mutations += 1
+            return scope
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(token)
+        self.mutations += 1
+        self._used -= 1
+        if self._clocks[i]:
+            # 保留同步记录，防止旧的添加被同步回来
+            self._states[i] = REVOKED
+            self._revoked += 1
+        else:
+            self._states[i] = DELETED
+            self._deleted += 1
+        return self._scope_list[self._values[i]]
+
+    def __len__(self):
+        return self._used + len(self._other)
+
+    def __iter__(self):
+        for token in list(self._other):
+            yield token
+        states = self._states
+        keys = self._keys
+        for i in range(self._capacity):
+            if states[i] == USED:
+                yield decode_token(keys[i])
+
+    def items(self):
+        for token, scope in list(self._other.items()):
+            yield token, scope
+        states = self._states
+        keys = self._keys
+        values = self._values
+        scopes = self._scope_list
+        for i in range(self._capacity):
+            if states[i] == USED:
+                yield decode_token(keys[i]), scopes[values[i]]
+
+    def copy(self):
+        """
+        复制整个映射（数组整块拷贝），用于在锁外遍历
+
+        持有锁的时间只是几次内存拷贝，百万级 token 也只需几十毫秒
+        """
+        other = object.__new__(CompactTokenMap)
+        other.__dict__.update(self.__dict__)
+        other._other = dict(self._other)
+        other._scope_list = list(self._scope_list)
+        other._scope_ids = dict(self._scope_ids)
+        other._node_list = list(self._node_list)
+        other._node_ids = dict(self._node_ids)
+        other._other_stamps = dict(self._other_stamps)
+        other._keys = self._keys[:]
+        other._states = self._states[:]
+        other._values = self._values[:]
+        other._clocks = self._clocks[:]
+        other._nodes = self._nodes[:]
+        if self._bloom is not None:
+            other._bloom = bytearray(self._bloom)
+        return other
+
+    def scan(self, cursor, limit, match=None, max_slots=SCAN_SLOTS):
+        """
+        从 cursor 继续遍历，返回 ([(token, 授权范围)], 下一个 cursor)
+
+        cursor 为 0 表示从头开始，返回的 cursor 为 None 表示遍历结束；
+        每次最多返回 limit 条、最多检查 max_slots 个位置，调用方可以在两次调用之间释放锁。
+        match(授权范围) 为 False 的条目被跳过。
+        遍历期间被修改的 token 可能漏掉或重复出现（与 Redis SCAN 相同的弱一致性）
+        """
+        items = []
+        if cursor >= 0:
+            # 先遍历哈希表槽位
+            states = self._states
+            keys = self._keys
+            values = self._values
+            scopes = self._scope_list
+            capacity = self._capacity
+            end = min(capacity, cursor + max_slots)
+            i = cursor
+            while i < end:
+                if states[i] == USED:
+                    scope = scopes[values[i]]
+                    if match is None or match(scope):
+                        items.append((decode_token(keys[i]), scope))
+                        if len(items) >= limit:
+                            i += 1
+                            break
+                i += 1
+            if i < capacity:
+                return items, i
+            return items, (-1 if self._other else None)
+
+        # 再遍历兜底 dict，cursor = -(下标 + 1)
+        start = -cursor - 1
+        position = start
+        for token, scope in itertools.islice(self._other.items(), start, start + max_slots):
+            position += 1
+            if match is None or match(scope):
+                items.append((token, scope))
+                if len(items) >= limit:
+                    break
+        return items, (-(position + 1) if position < len(self._other) else None)
+
+    def memory_usage(self):
+        """哈希表数组与 Bloom 过滤器占用的字节数（不含兜底 dict）"""
+        columns = (self._keys, self._states, self._values, self._clocks, self._nodes)
+        size = sum(column.itemsize for column in columns) * self._capacity
+        if self._bloom is not None:
+            size += len(self._bloom)
+        return size
+
+
+class TokenList:
+    """
+    一组 token 的紧凑列表（非线程安全，调用方加锁）
+
+    固定格式的 token 存在 array('Q') 里，其他存在 list 里。删除时只记入
+    _removed，遍历时跳过，被删除的条目超过一半时整理一次；删除后又加入的
+    token 只取消删除标记，列表里不会出现重复。
+    调用方保证只 add() 不在列表里的 token、只 discard() 在列表里的 token
+    """
+
+    def __init__(self):
+        self._keys = array('Q')
+        self._other = []
+        self._removed = set()
+
+    def __len__(self):
+        return len(self._keys) + len(self._other) - len(self._removed)
+
+    def add(self, token):
+        key = encode_token(token)
+        item = token if key is None else key
+        if item in self._removed:
+            self._removed.discard(item)
+        elif key is None:
+            self._other.append(token)
+        else:
+            self._keys.append(key)
+
+    def discard(self, token):
+        key = encode_token(token)
+        self._removed.add(token if key is None else key)
+        if len(self._removed) * 2 > len(self._keys) + len(self._other):
+            self._compact()
+
+    def _compact(self):
+        removed = self._removed
+        self._keys = array('Q', itertools.filterfalse(removed.__contains__, self._keys))
+        self._other = [token for token in self._other if token not in removed]
+        self._removed = set()
+
+    def slice(self, start, limit):
+        """
+        从位置 start 开始取最多 limit 个 token，返回 (token 列表, 下一个位置)
+
+        下一个位置为 None 表示已到末尾。两次调用之间整理过列表时
+        可能漏掉或重复少量 token（与 CompactTokenMap.scan 相同的弱一致性）
+        """
+        removed = self._removed
+        keys = self._keys
+        tokens = []
+        i = start
+        while i < len(keys) and len(tokens) < limit:
+            key = keys[i]
+            i += 1
+            if key not in removed:
+                tokens.append(decode_token(key))
+        end = len(keys) + len(self._other)
+        while i < end and len(tokens) < limit:
+            token = self._other[i - len(keys)]
+            i += 1
+            if token not in removed:
+                tokens.append(token)
+        return tokens, (i if i < end else None)
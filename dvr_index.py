@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DVR 录像索引 - 内存映射扫描 FLV 文件，建立关键帧索引
+
+只读取每个 tag 的 11 字节头（以及视频 tag 的第一个字节判断关键帧），
+不复制音视频数据；索引保存在 <文件名>.idx，录像还在写入时再次调用
+会从上次扫描到的位置继续。
+
+用法:
+  python dvr_index.py index 录像.flv             # 建立/更新索引
+  python dvr_index.py seek 录像.flv 95.5         # 查找 95.5 秒前最近的关键帧
+  python dvr_index.py clip 录像.flv 60 120 片段.flv  # 无损导出 60~120 秒
+"""
+
+from array import array
+from bisect import bisect_right
+import mmap
+import os
+import struct
+import sys
+from pathlib import Path
+
+FLV_SIGNATURE = b'FLV'
+TAG_HEADER_SIZE = 11
+PREV_TAG_SIZE = 4
+
+TAG_AUDIO = 8
+TAG_VIDEO = 9
+TAG_SCRIPT = 18
+
+VIDEO_KEYFRAME = 1
+AVC_SEQUENCE_HEADER = 0
+AAC_SEQUENCE_HEADER = 0
+SOUND_FORMAT_AAC = 10
+
+# 索引文件: 魔数 + 头部字段 + 关键帧时间戳数组(uint32) + 关键帧偏移数组(uint64)
+INDEX_MAGIC = b'FLVIDX01'
+INDEX_HEADER = struct.Struct('<8sQQQIqqqI')
+
+
+def read_timestamp(mm, offset):
+    """tag 头中的时间戳：低 24 位 + 扩展的高 8 位（毫秒）"""
+    return (mm[offset + 4] << 16 | mm[offset + 5] << 8 | mm[offset + 6]) | (mm[offset + 7] << 24)
+
+
+def scan_tags(mm, offset, limit):
+    """
+    从 offset 开始遍历完整的 tag
+
+    产出 (tag 偏移, tag 类型, 数据长度, 时间戳)；遇到写了一半的 tag 即停止
+    """
+    while offset + TAG_HEADER_SIZE <= limit:
+        tag_type = mm[offset] & 0x1F
+        data_size = mm[offset + 1] << 16 | mm[offset + 2] << 8 | mm[offset + 3]
+        end = offset + TAG_HEADER_SIZE + data_size + PREV_TAG_SIZE
+        if end > limit:
+            return
+        yield offset, tag_type, data_size, read_timestamp(mm, offset)
+        offset = end
+
+
+class FlvIndex:
+    """一个 FLV 文件的关键帧索引"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.index_path = self.path.with_name(self.path.name + '.idx')
+        self.file_size = 0
+        self.data_offset = 0        # 第一个 tag 的偏移
+        self.end_offset = 0         # 已扫描的最后一个完整 tag 之后的偏移
+        self.duration = 0           # 已扫描部分的最大时间戳（毫秒）
+        self.script_offset = -1     # onMetaData 所在 tag
+        self.video_config = -1      # AVC 序列头所在 tag
+        self.audio_config = -1      # AAC 序列头所在 tag
+        self.times = array('I')
+        self.offsets = array('Q')
+
+    # ------------------------------------------------------------
+    # 建立 / 读写索引
+    # ------------------------------------------------------------
+
+    @classmethod
+    def open(cls, path, cancelled=None):
+        """读取已有索引并扫描新增部分；索引不存在或失效时重新建立"""
+        index = cls(path)
+        if not index._load():
+            index = cls(path)
+        if index.update(cancelled):
+            index.save()
+        return index
+
+    @classmethod
+    def load(cls, path):
+        """只读取已有索引（不扫描录像）；索引不存在或失效时返回 None"""
+        index = cls(path)
+        return index if index._load() else None
+
+    def update(self, cancelled=None):
+        """
+        扫描 end_offset 之后新写入的 tag，返回索引是否有变化
+
+        cancelled（threading.Event）被设置时提前停止，已扫描的部分仍然有效，
+        下次调用从停止处继续
+        """
+        size = self.path.stat().st_size
+        if size == self.file_size and self.end_offset:
+            return False
+        if not size:
+            raise ValueError(f"录像文件为空: {self.path}")
+
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if not self.end_offset:
+                self._read_header(mm)
+            for offset, tag_type, data_size, timestamp in scan_tags(mm, self.end_offset, size):
+                if cancelled is not None and cancelled.is_set():
+                    # 不更新 file_size，下次调用会继续扫描
+                    return True
+                self._index_tag(mm, offset, tag_type, data_size, timestamp)
+                self.end_offset = offset + TAG_HEADER_SIZE + data_size + PREV_TAG_SIZE
+
+        self.file_size = size
+        return True
+
+    def _read_header(self, mm):
+        if len(mm) < 9 or mm[:3] != FLV_SIGNATURE:
+            raise ValueError(f"不是 FLV 文件: {self.path}")
+        header_size = struct.unpack_from('>I', mm, 5)[0]
+        self.data_offset = self.end_offset = header_size + PREV_TAG_SIZE
+
+    def _index_tag(self, mm, offset, tag_type, data_size, timestamp):
+        if timestamp > self.duration:
+            self.duration = timestamp
+        if not data_size:
+            return
+
+        first = mm[offset + TAG_HEADER_SIZE]
+        if tag_type == TAG_VIDEO:
+            if (first >> 4) & 0x07 != VIDEO_KEYFRAME:
+                return
+            # AVC 序列头带关键帧标志，但不是可解码的画面
+            if data_size > 1 and mm[offset + TAG_HEADER_SIZE + 1] == AVC_SEQUENCE_HEADER \
+                    and first & 0x0F == 7:
+                if self.video_config < 0:
+                    self.video_config = offset
+                return
+            # 同一时间戳只记录第一个关键帧，保证时间戳数组严格递增
+            if not self.times or timestamp > self.times[-1]:
+                self.times.append(timestamp)
+                self.offsets.append(offset)
+        elif tag_type == TAG_AUDIO:
+            if self.audio_config < 0 and first >> 4 == SOUND_FORMAT_AAC and data_size > 1 \
+                    and mm[offset + TAG_HEADER_SIZE + 1] == AAC_SEQUENCE_HEADER:
+                self.audio_config = offset
+        elif tag_type == TAG_SCRIPT:
+            if self.script_offset < 0:
+                self.script_offset = offset
+
+    def save(self):
+        """原子写入索引文件"""
+        tmp_path = self.index_path.with_name(self.index_path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(
+                INDEX_MAGIC, self.file_size, self.data_offset, self.end_offset,
+                self.duration, self.script_offset, self.video_config,
+                self.audio_config, len(self.times)
+            ))
+            self.times.tofile(f)
+            self.offsets.tofile(f)
+        os.replace(tmp_path, self.index_path)
+
+    def _load(self):
+        """读取索引文件；录像被截短或索引损坏时返回 False"""
+        try:
+            with open(self.index_path, 'rb') as f:
+                fields = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+                (magic, self.file_size, self.data_offset, self.end_offset,
+                 self.duration, self.script_offset, self.video_config,
+                 self.audio_config, count) = fields
+                if magic != INDEX_MAGIC:
+                    return False
+                self.times.fromfile(f, count)
+                self.offsets.fromfile(f, count)
+        except (OSError, EOFError, ValueError, struct.error):
+            return False
+        return self.path.stat().st_size >= self.file_size
+
+    # ------------------------------------------------------------
+    # 查询与导出
+    # ------------------------------------------------------------
+
+    def seek(self, ms):
+        """返回不晚于 ms 的最近关键帧 (时间戳, 文件偏移)；没有关键帧时返回 None"""
+        i = bisect_right(self.times, ms) - 1
+        if i < 0:
+            if not self.times:
+                return None
+            i = 0
+        return self.times[i], self.offsets[i]
+
+    def byte_range(self, start_ms, end_ms):
+        """
+        片段对应的字节范围 [起始关键帧, 结束时间之后的第一个关键帧)
+
+        两端都落在关键帧上，直接拷贝即可无损播放
+        """
+        found = self.seek(start_ms)
+        if found is None:
+            raise ValueError("录像中没有关键帧")
+        start_ts, start = found
+
+        i = bisect_right(self.times, end_ms)
+        end = self.offsets[i] if i < len(self.times) else self.end_offset
+        return start_ts, start, end
+
+    def extract_clip(self, start_ms, end_ms, out_path, rebase=True, cancelled=None):
+        """
+        无损导出片段：FLV 头 + onMetaData + 音视频序列头 + 关键帧对齐的字节范围
+
+        rebase 为 True 时把片段时间戳平移到从 0 开始（只改写 tag 头，数据原样拷贝）
+        返回导出的字节数；cancelled（threading.Event）被设置时停止并返回 None，
+        输出文件不完整，由调用方删除
+        """
+        start_ts, start, end = self.byte_range(start_ms, end_ms)
+        shift = start_ts if rebase else 0
+
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+                open(out_path, 'wb') as out:
+            view = memoryview(mm)
+            try:
+                out.write(view[:self.data_offset])
+                for offset in (self.script_offset, self.video_config, self.audio_config):
+                    if 0 <= offset < start:
+                        self._write_tag(out, mm, view, offset, 0)
+
+                for offset, _, data_size, timestamp in scan_tags(mm, start, end):
+                    if cancelled is not None and cancelled.is_set():
+                        return None
+                    self._write_tag(out, mm, view, offset, max(0, timestamp - shift))
+            finally:
+                view.release()
+            return out.tell()
+
+    @staticmethod
+    def _write_tag(out, mm, view, offset, timestamp):
+        data_size = mm[offset + 1] << 16 | mm[offset + 2] << 8 | mm[offset + 3]
+        header = bytearray(view[offset:offset + TAG_HEADER_SIZE])
+        header[4:7] = (timestamp & 0xFFFFFF).to_bytes(3, 'big')
+        header[7] = (timestamp >> 24) & 0xFF
+        out.write(header)
+        out.write(view[offset + TAG_HEADER_SIZE:offset + TAG_HEADER_SIZE + data_size + PREV_TAG_SIZE])
+
+
+def main(argv):
+    if len(argv) < 2 or argv[0] not in ('index', 'seek', 'clip'):
+        print(__doc__)
+        return 1
+
+    command, path = argv[0], argv[1]
+    index = FlvIndex.open(path)
+
+    if command == 'index':
+        print(f"{path}: 时长 {index.duration / 1000:.1f}s, 关键帧 {len(index.times)} 个")
+    elif command == 'seek':
+        found = index.seek(int(float(argv[2]) * 1000))
+        if found is None:
+            print("没有关键帧")
+            return 1
+        print(f"关键帧 {found[0] / 1000:.3f}s @ 字节偏移 {found[1]}")
+    else:
+        size = index.extract_clip(int(float(argv[2]) * 1000), int(float(argv[3]) * 1000), argv[4])
+        print(f"已导出 {argv[4]} ({size} 字节)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
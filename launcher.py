@@ -1,16 +1,37 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import tkinter as tk
-from tkinter import ttk, messagebox, scrolledtext
+from tkinter import ttk, messagebox, scrolledtext, filedialog
 import subprocess
 import time
 import json
 import secrets
+import urllib.request
+import urllib.error
+import urllib.parse
 from pathlib import Path
 import platform
+import signal
+import os
 import sys
 from datetime import datetime
 
+from dvr_index import FlvIndex
+from task_runner import TaskRunner
+
+# Token 修改的合并间隔（毫秒），期间的多次生成/删除只保存一次
+TOKEN_EDIT_DELAY_MS = 300
+
+# Token 列表最多显示的数量（服务器分页返回，只取第一页）
+TOKEN_LIST_LIMIT = 1000
+
+# 启动时等待验证服务器就绪的超时（秒）
+AUTH_START_TIMEOUT = 10
+
+# 验证服务器平滑重启期间拒绝修改（HTTP 503），重试的次数与间隔（秒）
+AUTH_RESTART_RETRIES = 20
+AUTH_RESTART_RETRY_DELAY = 0.5
+
 class StreamingLauncher:
     def __init__(self):
         self.root = tk.Tk()
@@ -20,11 +41,27 @@ class StreamingLauncher:
         self.root_dir = Path(__file__).parent
         self.is_windows = platform.system() == "Windows"
         self.token_file = self.root_dir / "auth" / "valid_tokens.json"
+        self.admin_key_file = self.root_dir / "auth" / "admin_key.txt"
+        self.auth_api = "http://127.0.0.1:8080"
         self.config_file = self.root_dir / "user_config.json"
+        self.srs_generated_conf = self.root_dir / "srs" / "conf" / "live_generated.conf"
+        self.dvr_dir = self.root_dir / "srs" / "objs" / "nginx" / "html" / "dvr"
         
         self.processes = []
         self.is_running = False
         
+        # 文件和网络操作都在后台线程执行，结果回到主线程更新界面
+        self.tasks = TaskRunner(self.root)
+        # 尚未保存的 Token 修改: token -> ('+', 流) 或 ('-', None)
+        self._token_edits = {}
+        self._token_edit_callbacks = []
+        self._token_edit_timer = None
+        # 关闭窗口后等待 Token 修改保存完成再退出
+        self._closing = False
+        # Token 列表下次刷新后要选中的 token
+        self._select_token = None
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
+        
         self._create_widgets()
         self._load_config()
         self._refresh_token_list()
@@ -45,15 +82,32 @@ class StreamingLauncher:
         token_tab = ttk.Frame(notebook)
         notebook.add(token_tab, text="🔑 Token 管理")
         
-        # 标签页 3: 运行日志
+        # 标签页 3: 观看统计
+        self.stats_tab = ttk.Frame(notebook)
+        notebook.add(self.stats_tab, text="📈 观看统计")
+        
+        # 标签页 4: 录像
+        dvr_tab = ttk.Frame(notebook)
+        notebook.add(dvr_tab, text="🎞️ 录像")
+        
+        # 标签页 5: 运行日志
         log_tab = ttk.Frame(notebook)
         notebook.add(log_tab, text="📋 运行日志")
         
+        self.notebook = notebook
+        
         # === 配置标签页 ===
         self._create_config_tab(config_tab)
         
         # === Token 管理标签页 ===
         self._create_token_tab(token_tab)
+        self._update_obs_config_display()
+        
+        # === 观看统计标签页 ===
+        self._create_stats_tab(self.stats_tab)
+        
+        # === 录像标签页 ===
+        self._create_dvr_tab(dvr_tab)
         
         # === 日志标签页 ===
         self._create_log_tab(log_tab)
@@ -135,15 +189,39 @@ class StreamingLauncher:
             row=row, column=2, sticky="w"
         )
         
-        # 流名称
+        # 流列表
         row += 1
-        ttk.Label(config_frame, text="流名称:", font=("Arial", 10)).grid(
+        ttk.Label(config_frame, text="流列表:", font=("Arial", 10)).grid(
+            row=row, column=0, sticky="nw", pady=8
+        )
+        stream_frame = ttk.Frame(config_frame)
+        stream_frame.grid(row=row, column=1, pady=8, padx=10, sticky="w")
+        
+        self.stream_listbox = tk.Listbox(stream_frame, width=24, height=4, font=("Arial", 10))
+        self.stream_listbox.pack(side="left")
+        self.stream_listbox.insert(tk.END, "stream")
+        
+        stream_buttons = ttk.Frame(stream_frame)
+        stream_buttons.pack(side="left", padx=(8, 0))
+        self.new_stream_name = ttk.Entry(stream_buttons, width=14, font=("Arial", 10))
+        self.new_stream_name.pack(pady=(0, 4))
+        ttk.Button(stream_buttons, text="➕ 添加流", command=self._add_stream, width=12).pack()
+        ttk.Button(stream_buttons, text="➖ 删除流", command=self._remove_stream, width=12).pack(pady=(4, 0))
+        
+        ttk.Label(config_frame, text="推流 URL 的 stream 部分（可多个）", foreground="gray").grid(
+            row=row, column=2, sticky="nw", pady=8
+        )
+        
+        # 录像
+        row += 1
+        ttk.Label(config_frame, text="录像 (DVR):", font=("Arial", 10)).grid(
             row=row, column=0, sticky="w", pady=8
         )
-        self.stream_name = ttk.Entry(config_frame, width=40, font=("Arial", 10))
-        self.stream_name.grid(row=row, column=1, pady=8, padx=10)
-        self.stream_name.insert(0, "stream")
-        ttk.Label(config_frame, text="推流 URL 的 stream 部分", foreground="gray").grid(
+        self.dvr_enabled = tk.BooleanVar(value=False)
+        ttk.Checkbutton(config_frame, text="启用录像", variable=self.dvr_enabled).grid(
+            row=row, column=1, sticky="w", pady=8, padx=10
+        )
+        ttk.Label(config_frame, text="使用生成的 srs/conf/live_generated.conf 启动 SRS", foreground="gray").grid(
             row=row, column=2, sticky="w"
         )
         
@@ -177,6 +255,14 @@ class StreamingLauncher:
         )
         self.stop_btn.pack(side="left", padx=10)
         
+        self.reload_btn = ttk.Button(
+            control_frame, 
+            text="🔄 重新加载验证服务器", 
+            command=self._reload_system,
+            width=25
+        )
+        self.reload_btn.pack(side="left", padx=10)
+        
         # OBS 配置提示
         obs_frame = ttk.LabelFrame(parent, text="📺 OBS 推流配置", padding=15)
         obs_frame.pack(fill="x", padx=20, pady=10)
@@ -209,6 +295,15 @@ class StreamingLauncher:
         )
         subtitle.pack()
         
+        # 当前流选择：Token 列表、生成的 Token 和观看链接都针对该流
+        stream_select_frame = ttk.Frame(parent)
+        stream_select_frame.pack(fill="x", padx=20, pady=(10, 0))
+        
+        ttk.Label(stream_select_frame, text="当前流:", font=("Arial", 10)).pack(side="left")
+        self.current_stream = ttk.Combobox(stream_select_frame, width=30, state="readonly")
+        self.current_stream.pack(side="left", padx=5)
+        self.current_stream.bind("<<ComboboxSelected>>", lambda e: self._refresh_token_list())
+        
         # Token 管理区域
         token_management_frame = ttk.Frame(parent)
         token_management_frame.pack(fill="both", padx=20, pady=15, expand=True)
@@ -296,6 +391,285 @@ class StreamingLauncher:
         # 绑定选择事件
         self.token_tree.bind("<<TreeviewSelect>>", self._on_token_select)
     
+    def _create_stats_tab(self, parent):
+        """创建观看统计标签页"""
+        control_frame = ttk.Frame(parent)
+        control_frame.pack(fill="x", padx=20, pady=10)
+        
+        ttk.Label(control_frame, text="统计对象:").pack(side="left")
+        self.stats_key = ttk.Combobox(control_frame, width=45, state="readonly")
+        self.stats_key.pack(side="left", padx=5)
+        self.stats_key.set("all")
+        self.stats_key.bind("<<ComboboxSelected>>", lambda e: self._refresh_stats())
+        
+        ttk.Label(control_frame, text="分辨率:").pack(side="left", padx=(15, 0))
+        self.stats_resolution = ttk.Combobox(
+            control_frame,
+            width=6,
+            state="readonly",
+            values=("1s", "1m", "1h")
+        )
+        self.stats_resolution.pack(side="left", padx=5)
+        self.stats_resolution.set("1s")
+        self.stats_resolution.bind("<<ComboboxSelected>>", lambda e: self._refresh_stats())
+        
+        ttk.Button(
+            control_frame,
+            text="🔄 刷新",
+            command=self._refresh_stats,
+            width=10
+        ).pack(side="left", padx=10)
+        
+        self.stats_summary = ttk.Label(parent, text="验证服务器未运行", foreground="gray")
+        self.stats_summary.pack(anchor="w", padx=20)
+        
+        self.stats_canvas = tk.Canvas(parent, background="white", highlightthickness=0)
+        self.stats_canvas.pack(fill="both", expand=True, padx=20, pady=10)
+    
+    def _refresh_stats(self):
+        """在后台从验证服务器拉取统计数据，完成后重绘"""
+        key = self.stats_key.get() or "all"
+        resolution = self.stats_resolution.get() or "1s"
+        self.tasks.submit(
+            "stats",
+            lambda cancelled: self._fetch_stats(key, resolution),
+            on_done=lambda result: self._show_stats(key, *result),
+            on_error=lambda e: self._log(f"✗ 获取统计失败: {e}")
+        )
+    
+    def _fetch_stats(self, key, resolution):
+        """后台线程: 返回 (统计对象列表, 时间序列)，服务器未运行时为 None"""
+        keys = self._admin_request("GET", "/admin/stats")
+        if keys is None or keys.get("code") != 0:
+            return None, None
+        
+        query = urllib.parse.urlencode({"key": key, "resolution": resolution})
+        data = self._admin_request("GET", "/admin/stats/series?" + query)
+        return keys, data
+    
+    def _show_stats(self, key, keys, data):
+        if keys is None:
+            self.stats_summary.config(text="验证服务器未运行")
+            self.stats_canvas.delete("all")
+            return
+        
+        self.stats_key.config(values=sorted(keys["series"]))
+        
+        if data is None or data.get("code") != 0:
+            self.stats_summary.config(text=f"{key}: 暂无数据")
+            self.stats_canvas.delete("all")
+            return
+        
+        self.stats_summary.config(
+            text=f"{key} | 当前在线: {data['current']} | "
+                 f"窗口内连接: {sum(data['connects'])} | 窗口内拒绝: {sum(data['denies'])}"
+        )
+        self._draw_stats(data)
+    
+    def _draw_stats(self, data):
+        """绘制在线人数（蓝线）与拒绝数（红柱）"""
+        canvas = self.stats_canvas
+        canvas.delete("all")
+        
+        width = max(canvas.winfo_width(), 200)
+        height = max(canvas.winfo_height(), 100)
+        pad = 40
+        
+        viewers = data["viewers"]
+        denies = data["denies"]
+        peak = max(max(viewers), max(denies), 1)
+        step = (width - 2 * pad) / max(len(viewers) - 1, 1)
+        
+        def y_of(value):
+            return height - pad - (height - 2 * pad) * value / peak
+        
+        # 坐标轴
+        canvas.create_line(pad, height - pad, width - pad, height - pad, fill="gray")
+        canvas.create_line(pad, pad, pad, height - pad, fill="gray")
+        canvas.create_text(pad - 5, y_of(peak), text=str(peak), anchor="e", fill="gray")
+        canvas.create_text(pad - 5, height - pad, text="0", anchor="e", fill="gray")
+        
+        start = datetime.fromtimestamp(data["start"]).strftime("%m-%d %H:%M:%S")
+        canvas.create_text(pad, height - pad + 15, text=start, anchor="w", fill="gray")
+        canvas.create_text(width - pad, height - pad + 15, text="现在", anchor="e", fill="gray")
+        
+        for i, value in enumerate(denies):
+            if value:
+                x = pad + i * step
+                canvas.create_line(x, height - pad, x, y_of(value), fill="red")
+        
+        points = []
+        for i, value in enumerate(viewers):
+            points.extend((pad + i * step, y_of(value)))
+        canvas.create_line(*points, fill="blue", width=2)
+    
+    def _create_dvr_tab(self, parent):
+        """创建录像标签页"""
+        info = ttk.Label(
+            parent,
+            text=f"录像目录: {self.dvr_dir}（在'配置'中启用录像后由 SRS 写入）",
+            font=("Arial", 9),
+            foreground="gray"
+        )
+        info.pack(anchor="w", padx=20, pady=(10, 0))
+        
+        list_frame = ttk.Frame(parent)
+        list_frame.pack(fill="both", expand=True, padx=20, pady=10)
+        
+        columns = ("size", "duration", "keyframes")
+        self.dvr_tree = ttk.Treeview(list_frame, columns=columns, show="tree headings", height=12)
+        self.dvr_tree.heading("#0", text="文件")
+        self.dvr_tree.heading("size", text="大小")
+        self.dvr_tree.heading("duration", text="时长")
+        self.dvr_tree.heading("keyframes", text="关键帧")
+        self.dvr_tree.column("#0", width=420)
+        self.dvr_tree.column("size", width=100, anchor="e")
+        self.dvr_tree.column("duration", width=100, anchor="e")
+        self.dvr_tree.column("keyframes", width=80, anchor="e")
+        
+        scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.dvr_tree.yview)
+        self.dvr_tree.configure(yscrollcommand=scrollbar.set)
+        self.dvr_tree.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+        
+        control_frame = ttk.Frame(parent)
+        control_frame.pack(fill="x", padx=20, pady=(0, 15))
+        
+        ttk.Button(control_frame, text="🔄 刷新", command=self._refresh_dvr_list, width=10).pack(side="left")
+        ttk.Button(control_frame, text="📑 建立索引", command=self._index_recording, width=12).pack(side="left", padx=5)
+        
+        ttk.Label(control_frame, text="片段 起始(秒):").pack(side="left", padx=(20, 0))
+        self.clip_start = ttk.Entry(control_frame, width=8)
+        self.clip_start.pack(side="left", padx=5)
+        self.clip_start.insert(0, "0")
+        ttk.Label(control_frame, text="结束(秒):").pack(side="left")
+        self.clip_end = ttk.Entry(control_frame, width=8)
+        self.clip_end.pack(side="left", padx=5)
+        self.clip_end.insert(0, "60")
+        ttk.Button(control_frame, text="✂️ 导出片段", command=self._export_clip, width=12).pack(side="left", padx=5)
+        ttk.Button(control_frame, text="⏹ 取消", command=self._cancel_dvr_task, width=8).pack(side="left")
+        
+        self._refresh_dvr_list()
+    
+    def _refresh_dvr_list(self):
+        """在后台列出录像文件（已建立索引的显示时长）"""
+        self.tasks.submit(
+            "dvr_list",
+            lambda cancelled: self._scan_recordings(),
+            on_done=self._show_recordings,
+            on_error=lambda e: self._log(f"✗ 读取录像列表失败: {e}")
+        )
+    
+    def _scan_recordings(self):
+        """后台线程: 返回 [(相对路径, 大小, 时长, 关键帧数)]"""
+        if not self.dvr_dir.exists():
+            return []
+        
+        rows = []
+        for path in sorted(self.dvr_dir.rglob("*.flv")):
+            index = FlvIndex.load(path)
+            rows.append((
+                str(path.relative_to(self.dvr_dir)),
+                f"{path.stat().st_size / 1024 / 1024:.1f} MB",
+                f"{index.duration / 1000:.1f}s" if index else "-",
+                len(index.times) if index else "-"
+            ))
+        return rows
+    
+    def _show_recordings(self, rows):
+        for item in self.dvr_tree.get_children():
+            self.dvr_tree.delete(item)
+        
+        for name, size, duration, keyframes in rows:
+            self.dvr_tree.insert("", "end", text=name, values=(size, duration, keyframes))
+    
+    def _selected_recording(self):
+        selection = self.dvr_tree.selection()
+        if not selection:
+            messagebox.showwarning("提示", "请先选择一个录像")
+            return None
+        return self.dvr_dir / self.dvr_tree.item(selection[0])['text']
+    
+    def _cancel_dvr_task(self):
+        """取消正在进行的建立索引/导出（索引已扫描的部分会保留）"""
+        if self.tasks.cancel("dvr"):
+            self.status_label.config(text="已取消")
+            self._log("已取消录像操作")
+    
+    def _index_recording(self):
+        """在后台建立/更新选中录像的关键帧索引"""
+        path = self._selected_recording()
+        if path is None:
+            return
+        
+        def done(index):
+            self.status_label.config(text="✓ 索引已建立")
+            self._log(f"已建立索引: {path.name}（时长 {index.duration / 1000:.1f}s，关键帧 {len(index.times)} 个）")
+            self._refresh_dvr_list()
+        
+        def failed(e):
+            self.status_label.config(text="✗ 建立索引失败")
+            messagebox.showerror("错误", f"建立索引失败: {e}")
+        
+        self.status_label.config(text=f"正在建立索引: {path.name}...")
+        self.tasks.submit(
+            "dvr",
+            lambda cancelled: FlvIndex.open(path, cancelled),
+            on_done=done,
+            on_error=failed
+        )
+    
+    def _export_clip(self):
+        """在后台按关键帧无损导出片段"""
+        path = self._selected_recording()
+        if path is None:
+            return
+        
+        try:
+            start = float(self.clip_start.get())
+            end = float(self.clip_end.get())
+        except ValueError:
+            messagebox.showerror("错误", "起始/结束时间必须是数字（秒）")
+            return
+        if end <= start:
+            messagebox.showerror("错误", "结束时间必须大于起始时间")
+            return
+        
+        out_path = filedialog.asksaveasfilename(
+            defaultextension=".flv",
+            initialfile=f"{path.stem}_{int(start)}-{int(end)}.flv",
+            filetypes=[("FLV", "*.flv")]
+        )
+        if not out_path:
+            return
+        
+        def done(size):
+            self.status_label.config(text="✓ 片段已导出")
+            self._log(f"已导出片段: {out_path} ({size / 1024 / 1024:.1f} MB)")
+            messagebox.showinfo("成功", f"片段已导出:\n\n{out_path}\n\n起止时间已对齐到关键帧")
+        
+        def failed(e):
+            self.status_label.config(text="✗ 导出失败")
+            messagebox.showerror("错误", f"导出失败: {e}")
+        
+        self.status_label.config(text=f"正在导出片段: {Path(out_path).name}...")
+        self.tasks.submit(
+            "dvr",
+            lambda cancelled: self._extract_clip(path, int(start * 1000), int(end * 1000), out_path, cancelled),
+            on_done=done,
+            on_error=failed
+        )
+    
+    def _extract_clip(self, path, start_ms, end_ms, out_path, cancelled):
+        """后台线程: 更新索引并导出片段，取消时删除不完整的输出文件"""
+        index = FlvIndex.open(path, cancelled)
+        size = None
+        if not cancelled.is_set():
+            size = index.extract_clip(start_ms, end_ms, out_path, cancelled=cancelled)
+        if size is None:
+            Path(out_path).unlink(missing_ok=True)
+        return size
+    
     def _create_log_tab(self, parent):
         """创建日志标签页"""
         self.log_text = scrolledtext.ScrolledText(
@@ -329,9 +703,13 @@ class StreamingLauncher:
                 self.app_name.delete(0, tk.END)
                 self.app_name.insert(0, app_name)
                 
-                stream_name = config.get('stream_name', 'stream')
-                self.stream_name.delete(0, tk.END)
-                self.stream_name.insert(0, stream_name)
+                # 兼容旧配置的单个 stream_name
+                streams = config.get('streams') or [config.get('stream_name', 'stream')]
+                self.stream_listbox.delete(0, tk.END)
+                for stream in streams:
+                    self.stream_listbox.insert(tk.END, stream)
+                
+                self.dvr_enabled.set(config.get('dvr_enabled', False))
                 
                 self._update_obs_config_display()
                 
@@ -344,7 +722,8 @@ class StreamingLauncher:
             'remote_port': self.remote_port.get().strip(),
             'local_port': self.local_port.get().strip(),
             'app_name': self.app_name.get().strip(),
-            'stream_name': self.stream_name.get().strip()
+            'streams': self._get_stream_names(),
+            'dvr_enabled': self.dvr_enabled.get()
         }
         
         # 验证
@@ -352,24 +731,85 @@ class StreamingLauncher:
             messagebox.showerror("错误", "请填写 FRP 服务器地址和云端端口")
             return
         
+        self._update_obs_config_display()
+        
+        def done(_):
+            messagebox.showinfo("成功", "配置已保存")
+            self.status_label.config(text="✓ 配置已保存")
+            self._log("配置已保存")
+        
+        def failed(e):
+            self._log(f"✗ 保存配置失败: {e}")
+            messagebox.showerror("错误", f"保存配置失败: {e}")
+        
+        self.tasks.submit(
+            "config",
+            lambda cancelled: self._write_config(config),
+            on_done=done,
+            on_error=failed
+        )
+    
+    def _write_config(self, config):
+        """后台线程: 写入配置文件"""
         with open(self.config_file, 'w', encoding='utf-8') as f:
             json.dump(config, f, indent=2, ensure_ascii=False)
+    
+    def _get_stream_names(self):
+        """配置中的流名称列表"""
+        return list(self.stream_listbox.get(0, tk.END)) or ["stream"]
+    
+    def _get_current_stream(self):
+        """Token 管理标签页中选中的流，返回 (app, stream)"""
+        app_name = self.app_name.get().strip() or "live"
+        stream_name = self.current_stream.get() or self._get_stream_names()[0]
+        return app_name, stream_name
+    
+    def _add_stream(self):
+        """添加流"""
+        name = self.new_stream_name.get().strip()
+        if not name or "/" in name:
+            messagebox.showwarning("提示", "请输入流名称（不能包含 /）")
+            return
+        if name in self._get_stream_names():
+            messagebox.showwarning("提示", f"流 {name} 已存在")
+            return
+        
+        self.stream_listbox.insert(tk.END, name)
+        self.new_stream_name.delete(0, tk.END)
+        self._update_obs_config_display()
+        self._log(f"已添加流: {name}（保存配置后生效）")
+    
+    def _remove_stream(self):
+        """删除流（已生成的 Token 保留，仍只能观看原来的流）"""
+        selection = self.stream_listbox.curselection()
+        if not selection:
+            messagebox.showwarning("提示", "请先选择一个流")
+            return
+        if self.stream_listbox.size() == 1:
+            messagebox.showwarning("提示", "至少需要保留一个流")
+            return
         
+        name = self.stream_listbox.get(selection[0])
+        self.stream_listbox.delete(selection[0])
         self._update_obs_config_display()
-        messagebox.showinfo("成功", "配置已保存")
-        self.status_label.config(text="✓ 配置已保存")
-        self._log("配置已保存")
+        self._log(f"已删除流: {name}（保存配置后生效）")
     
     def _update_obs_config_display(self):
         """更新 OBS 配置显示"""
         local_port = self.local_port.get().strip() or "19350"
         app_name = self.app_name.get().strip() or "live"
-        stream_name = self.stream_name.get().strip() or "stream"
+        stream_names = self._get_stream_names()
+        
+        # 同步 Token 管理标签页的流选择
+        if hasattr(self, 'current_stream'):
+            self.current_stream.config(values=stream_names)
+            if self.current_stream.get() not in stream_names:
+                self.current_stream.set(stream_names[0])
         
         obs_text = f"""OBS 推流配置:
 
 服务器: rtmp://127.0.0.1:{local_port}/{app_name}
-推流密钥: {stream_name}
+推流密钥: {" / ".join(stream_names)}（每路推流使用其中一个）
 
 配置步骤:
 1. OBS → 设置 → 推流
@@ -384,37 +824,194 @@ class StreamingLauncher:
         self.obs_config_text.config(state="disabled")
     
     def _get_watch_url(self, token):
-        """生成观看地址"""
+        """生成当前流的观看地址"""
         frp_server = self.frp_server.get().strip() or "YOUR-SERVER"
         remote_port = self.remote_port.get().strip() or "PORT"
-        app_name = self.app_name.get().strip() or "live"
-        stream_name = self.stream_name.get().strip() or "stream"
+        app_name, stream_name = self._get_current_stream()
         
         return f"rtmp://{frp_server}:{remote_port}/{app_name}/{stream_name}?token={token}"
 
-    def _load_tokens(self):
-        """加载 Token 列表"""
+    def _admin_request(self, method, path, payload=None):
+        """调用验证服务器的 Token 管理接口（只在后台线程调用）
+        
+        服务器未运行（连接被拒绝）时返回 None，调用方可回退到直接读写文件；
+        超时等其他网络错误说明服务器可能在运行，抛出 RuntimeError，不能回退。
+        服务器正在平滑重启（503）时稍等后重试
+        """
+        if not self.admin_key_file.exists():
+            return None
+        
+        admin_key = self.admin_key_file.read_text(encoding='utf-8').strip()
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        req = urllib.request.Request(
+            self.auth_api + path,
+            data=data,
+            method=method,
+            headers={"X-Admin-Key": admin_key, "Content-Type": "application/json"}
+        )
+        
+        for attempt in range(AUTH_RESTART_RETRIES + 1):
+            try:
+                with urllib.request.urlopen(req, timeout=3) as resp:
+                    return json.load(resp)
+            except urllib.error.HTTPError as e:
+                if e.code == 503 and attempt < AUTH_RESTART_RETRIES:
+                    time.sleep(AUTH_RESTART_RETRY_DELAY)
+                    continue
+                try:
+                    return json.load(e)
+                except Exception:
+                    raise RuntimeError(f"验证服务器返回错误: HTTP {e.code}")
+            except (urllib.error.URLError, OSError) as e:
+                reason = e.reason if isinstance(e, urllib.error.URLError) else e
+                if isinstance(reason, ConnectionRefusedError):
+                    return None
+                raise RuntimeError(f"无法连接验证服务器: {reason}")
+    
+    def _load_tokens(self, stream):
+        """
+        后台线程: 加载可观看 stream 的 Token 列表（优先从验证服务器读取）
+        
+        返回 (Token 列表, 是否还有更多)，最多 TOKEN_LIST_LIMIT 个
+        """
+        query = urllib.parse.urlencode({"stream": stream, "limit": TOKEN_LIST_LIMIT})
+        result = self._admin_request("GET", "/admin/tokens?" + query)
+        if result is not None and result.get("code") == 0:
+            return result["tokens"], result.get("next_cursor") is not None
+        
+        tokens = [
+            token for token, streams in self._load_token_file().items()
+            if streams is None or stream in streams
+        ]
+        return tokens[:TOKEN_LIST_LIMIT], len(tokens) > TOKEN_LIST_LIMIT
+    
+    def _load_token_file(self):
+        """从文件加载 {token: 可观看的流列表或 None}（兼容旧版纯列表格式）"""
         if not self.token_file.exists():
-            return []
+            return {}
         
         try:
             with open(self.token_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+                data = json.load(f)
+            return dict.fromkeys(data) if isinstance(data, list) else data
         except:
-            return []
+            return {}
     
     def _save_tokens(self, tokens):
-        """保存 Token 列表"""
+        """保存 Token 文件（仅在验证服务器未运行时直接写文件）"""
         self.token_file.parent.mkdir(parents=True, exist_ok=True)
         with open(self.token_file, 'w', encoding='utf-8') as f:
             json.dump(tokens, f, indent=2, ensure_ascii=False)
     
+    def _queue_token_edit(self, token, op, stream=None, on_saved=None):
+        """
+        记录一次 Token 修改，稍后与其他修改合并保存
+        
+        op 为 '+'（添加，只能观看 stream）或 '-'（删除）；同一 token 只保留最后一次修改。
+        保存成功后在主线程调用 on_saved()
+        """
+        self._token_edits[token] = (op, stream)
+        if on_saved is not None:
+            self._token_edit_callbacks.append(on_saved)
+        if self._token_edit_timer is None:
+            self._token_edit_timer = self.root.after(TOKEN_EDIT_DELAY_MS, self._flush_token_edits)
+    
+    def _flush_token_edits(self):
+        """把积累的修改交给后台保存（同一时间只有一批在保存，保证先后顺序）"""
+        self._token_edit_timer = None
+        if not self._token_edits or self.tasks.busy("token_edits"):
+            return
+        
+        edits, callbacks = self._token_edits, self._token_edit_callbacks
+        self._token_edits, self._token_edit_callbacks = {}, []
+        
+        def done(_):
+            if not self._closing:
+                for callback in callbacks:
+                    callback()
+            self._after_token_edits()
+        
+        def failed(e):
+            self._log(f"✗ 保存 Token 失败: {e}")
+            messagebox.showerror("错误", f"保存 Token 失败: {e}")
+            self._after_token_edits()
+        
+        self.tasks.submit(
+            "token_edits",
+            lambda cancelled: self._apply_token_edits(edits),
+            on_done=done,
+            on_error=failed
+        )
+    
+    def _after_token_edits(self):
+        """一批修改保存完成：继续保存期间新增的修改，否则刷新列表（正在关闭时退出）"""
+        if self._token_edits:
+            self._flush_token_edits()
+        elif self._closing:
+            self._destroy()
+        else:
+            self._refresh_token_list()
+    
+    def _apply_token_edits(self, edits):
+        """
+        后台线程: 保存一批 Token 修改
+        
+        服务器运行时每个流一次批量添加 + 一次批量吊销；否则只读写一次文件。
+        只有第一个请求就连接被拒绝时才写文件：服务器一旦接受过修改，
+        它的下一次写盘会覆盖这个文件
+        """
+        adds = {}
+        removes = []
+        for token, (op, stream) in edits.items():
+            if op == '+':
+                adds.setdefault(stream, []).append(token)
+            else:
+                removes.append(token)
+        
+        requests = [
+            ("/admin/tokens", {"tokens": tokens, "streams": [stream]})
+            for stream, tokens in adds.items()
+        ]
+        if removes:
+            requests.append(("/admin/tokens/revoke", {"tokens": removes}))
+        
+        for i, (path, payload) in enumerate(requests):
+            result = self._admin_request("POST", path, payload)
+            if result is None:
+                if i:
+                    raise RuntimeError("验证服务器在保存过程中停止，部分修改未保存")
+                break
+            if result.get("code") != 0:
+                raise RuntimeError(result.get("error", "保存失败"))
+        else:
+            return
+        
+        # 验证服务器未运行，直接修改文件
+        tokens = self._load_token_file()
+        for token, (op, stream) in edits.items():
+            if op == '+':
+                tokens[token] = [stream]
+            else:
+                tokens.pop(token, None)
+        self._save_tokens(tokens)
+    
     def _refresh_token_list(self):
-        """刷新 Token 列表显示"""
-        # 保存当前选中的项
-        current_selection = None
+        """在后台加载当前流的 Token，完成后刷新列表显示"""
+        stream = "/".join(self._get_current_stream())
+        self.tasks.submit(
+            "tokens",
+            lambda cancelled: self._load_tokens(stream),
+            on_done=lambda result: self._show_tokens(*result),
+            on_error=lambda e: self._log(f"✗ 加载 Token 失败: {e}")
+        )
+    
+    def _show_tokens(self, tokens, more=False):
+        """刷新 Token 列表显示（more 为 True 时只显示了前 TOKEN_LIST_LIMIT 个）"""
+        # 保存当前选中的项（刚生成的 token 优先）
+        current_selection = self._select_token
+        self._select_token = None
         selection = self.token_tree.selection()
-        if selection:
+        if current_selection is None and selection:
             item = self.token_tree.item(selection[0])
             current_selection = item['values'][0] if item['values'] else None
         
@@ -422,8 +1019,6 @@ class StreamingLauncher:
         for item in self.token_tree.get_children():
             self.token_tree.delete(item)
         
-        tokens = self._load_tokens()
-        
         # 重新填充列表
         for i, token in enumerate(tokens, 1):
             item_id = self.token_tree.insert(
@@ -442,13 +1037,21 @@ class StreamingLauncher:
         
         if not tokens:
             self._update_detail("暂无 Token,点击'生成新 Token'创建")
+        elif more:
+            self.status_label.config(text=f"Token 较多，列表只显示前 {TOKEN_LIST_LIMIT} 个")
     
     def _auto_refresh(self):
-        """每5秒自动刷新一次 token 状态"""
+        """每5秒自动刷新一次 token 状态（上一次还没完成或有未保存的修改时跳过）"""
         try:
             # 只在 token_tree 存在时刷新
-            if hasattr(self, 'token_tree') and self.token_tree.winfo_exists():
+            if hasattr(self, 'token_tree') and self.token_tree.winfo_exists() \
+                    and not self._token_edits and not self.tasks.busy("token_edits") \
+                    and not self.tasks.busy("tokens"):
                 self._refresh_token_list()
+            
+            # 统计标签页可见时才拉取数据
+            if self.notebook.select() == str(self.stats_tab) and not self.tasks.busy("stats"):
+                self._refresh_stats()
         except:
             pass
         
@@ -467,6 +1070,7 @@ class StreamingLauncher:
         watch_url = self._get_watch_url(token)
         
         detail = f"""Token: {token}
+流: {"/".join(self._get_current_stream())}
 
 观看地址:
 {watch_url}
@@ -484,25 +1088,16 @@ class StreamingLauncher:
         self.detail_text.config(state="disabled")
     
     def _generate_token(self):
-        """生成新 Token"""
+        """生成新 Token（后台保存，完成后自动选中）"""
         new_token = f"token_{secrets.token_hex(8)}"
+        stream = "/".join(self._get_current_stream())
         
-        tokens = self._load_tokens()
-        tokens.append(new_token)
-        self._save_tokens(tokens)
-        
-        self._refresh_token_list()
-        self._log(f"已生成新 Token: {new_token}")
-        
-        # 自动选中新生成的 token
-        children = self.token_tree.get_children()
-        if children:
-            last_item = children[-1]
-            self.token_tree.selection_set(last_item)
-            self.token_tree.focus(last_item)
-            self.token_tree.see(last_item)
+        def saved():
+            self._select_token = new_token
+            self._log(f"已生成新 Token: {new_token}")
+            messagebox.showinfo("成功", f"已生成新 Token:\n\n{new_token}\n\n请选中后点击'复制观看链接'")
         
-        messagebox.showinfo("成功", f"已生成新 Token:\n\n{new_token}\n\n请选中后点击'复制观看链接'")
+        self._queue_token_edit(new_token, '+', stream, saved)
     
     def _copy_token(self):
         """复制 Token"""
@@ -556,13 +1151,15 @@ class StreamingLauncher:
         if not result:
             return
         
-        tokens = self._load_tokens()
-        if token in tokens:
-            tokens.remove(token)
-            self._save_tokens(tokens)
-            self._refresh_token_list()
+        # 先从列表中移除，后台保存完成后再刷新
+        self.token_tree.delete(selection[0])
+        self._update_detail("")
+        
+        def saved():
             self._log(f"已删除 Token: {token}")
-            messagebox.showinfo("成功", "Token 已删除")
+            self.status_label.config(text="✓ Token 已删除")
+        
+        self._queue_token_edit(token, '-', on_saved=saved)
     
     def _check_files(self):
         """检查必要文件"""
@@ -590,7 +1187,7 @@ class StreamingLauncher:
         return errors
     
     def _start_system(self):
-        """启动系统"""
+        """启动系统（在后台依次启动各服务，启动过程中可点击停止取消）"""
         errors = self._check_files()
         if errors:
             messagebox.showerror(
@@ -602,39 +1199,71 @@ class StreamingLauncher:
         self._log("="*50)
         self._log("开始启动所有服务...")
         self.status_label.config(text="正在启动...")
+        self.start_btn.config(state="disabled")
+        self.stop_btn.config(state="normal")
         
-        try:
-            # 1. 启动验证服务器
-            self._log("▶ 启动验证服务器 (auth/server.py)...")
-            self._start_auth_server()
-            time.sleep(2)
-            
-            # 2. 启动 SRS
-            self._log("▶ 启动 SRS (srs/srs-live.bat)...")
-            self._start_srs()
-            time.sleep(2)
-            
-            # 3. 启动 frpc
-            self._log("▶ 启动 frpc (frpc/frpc.exe)...")
-            self._start_frpc()
-            time.sleep(2)
-            
-            self._log("="*50)
-            self._log("✓ 所有服务启动完成!")
-            self._log("")
-            self._log("下一步:")
-            self._log("1. 切换到'Token 管理'标签页生成观看链接")
-            self._log("2. 配置 OBS 并开始推流")
-            self._log("="*50)
-            
-            self.is_running = True
-            self.start_btn.config(state="disabled")
-            self.stop_btn.config(state="normal")
-            self.status_label.config(text="✓ 系统运行中")
-            
-        except Exception as e:
-            self._log(f"✗ 启动失败: {e}")
-            messagebox.showerror("启动失败", str(e))
+        dvr_enabled = self.dvr_enabled.get()
+        local_port = self.local_port.get().strip() or "19350"
+        self.tasks.submit(
+            "system",
+            lambda cancelled: self._start_services(cancelled, dvr_enabled, local_port),
+            on_done=self._on_system_started,
+            on_error=self._on_system_start_failed
+        )
+    
+    def _start_services(self, cancelled, dvr_enabled, local_port):
+        """后台线程: 依次启动验证服务器、SRS、frpc"""
+        log = lambda message: self.tasks.post(self._log, message)
+        
+        # 1. 启动验证服务器
+        log("▶ 启动验证服务器 (auth/server.py)...")
+        self._start_auth_server()
+        if not self._wait_auth_server(cancelled) and not cancelled.is_set():
+            log(f"警告: 验证服务器 {AUTH_START_TIMEOUT} 秒内未就绪，继续启动")
+        if cancelled.is_set():
+            return
+        
+        # 2. 启动 SRS
+        log("▶ 启动 SRS (srs/srs-live.bat)...")
+        self._start_srs(dvr_enabled, local_port, log)
+        if cancelled.wait(2):
+            return
+        
+        # 3. 启动 frpc
+        log("▶ 启动 frpc (frpc/frpc.exe)...")
+        self._start_frpc()
+        cancelled.wait(2)
+    
+    def _wait_auth_server(self, cancelled):
+        """后台线程: 等待验证服务器的 /health 可访问，超时或取消时返回 False"""
+        deadline = time.time() + AUTH_START_TIMEOUT
+        while time.time() < deadline:
+            try:
+                with urllib.request.urlopen(self.auth_api + "/health", timeout=1):
+                    return True
+            except (urllib.error.URLError, OSError):
+                if cancelled.wait(0.2):
+                    return False
+        return False
+    
+    def _on_system_started(self, _):
+        self._log("="*50)
+        self._log("✓ 所有服务启动完成!")
+        self._log("")
+        self._log("下一步:")
+        self._log("1. 切换到'Token 管理'标签页生成观看链接")
+        self._log("2. 配置 OBS 并开始推流")
+        self._log("="*50)
+        
+        self.is_running = True
+        self.status_label.config(text="✓ 系统运行中")
+        self._refresh_token_list()
+    
+    def _on_system_start_failed(self, e):
+        self._log(f"✗ 启动失败: {e}")
+        self.start_btn.config(state="normal")
+        self.status_label.config(text="✗ 启动失败")
+        messagebox.showerror("启动失败", str(e))
     
     def _start_auth_server(self):
         """启动验证服务器"""
@@ -650,16 +1279,67 @@ class StreamingLauncher:
             )
             self.processes.append(proc)
     
-    def _start_srs(self):
-        """启动 SRS"""
+    def _write_srs_config(self, local_port):
+        """生成启用录像的 SRS 配置（不修改用户自己的 live.conf）"""
+        conf = f"""# 由 launcher.py 生成，请勿手动修改（修改会在下次启动时被覆盖）
+listen              {local_port};
+max_connections     1000;
+daemon              off;
+srs_log_tank        console;
+
+vhost __defaultVhost__ {{
+    http_hooks {{
+        enabled         on;
+        on_publish      http://127.0.0.1:8080/api/on_publish;
+        on_play         http://127.0.0.1:8080/api/on_play;
+        on_stop         http://127.0.0.1:8080/api/on_stop;
+    }}
+
+    dvr {{
+        enabled             on;
+        dvr_apply           all;
+        dvr_plan            session;
+        dvr_path            ./objs/nginx/html/dvr/[app]/[stream].[timestamp].flv;
+        dvr_wait_keyframe   on;
+        time_jitter         full;
+    }}
+}}
+
+http_api {{
+    enabled         on;
+    listen          19850;
+}}
+
+http_server {{
+    enabled         on;
+    listen          19800;
+    dir             ./objs/nginx/html;
+}}
+"""
+        self.srs_generated_conf.parent.mkdir(parents=True, exist_ok=True)
+        self.srs_generated_conf.write_text(conf, encoding='utf-8')
+        return self.srs_generated_conf
+    
+    def _start_srs(self, dvr_enabled, local_port, log):
+        """启动 SRS（在后台线程调用，日志通过 log 输出）"""
         srs_dir = self.root_dir / "srs"
         
+        if dvr_enabled:
+            conf = self._write_srs_config(local_port).relative_to(srs_dir).as_posix()
+            log(f"已生成启用录像的 SRS 配置: {conf}")
+            if self.is_windows:
+                cmd = f'start "SRS" /D "{srs_dir}" srs.exe -c {conf}'
+                subprocess.Popen(cmd, shell=True)
+            else:
+                log(f"警告: Linux/Mac 请手动启动 SRS: ./objs/srs -c {conf}")
+            return
+        
         if self.is_windows:
             # 直接运行 srs-live.bat
             cmd = f'start "SRS" /D "{srs_dir}" srs-live.bat'
             subprocess.Popen(cmd, shell=True)
         else:
-            self._log("警告: Linux/Mac 请手动启动 SRS")
+            log("警告: Linux/Mac 请手动启动 SRS")
     
     def _start_frpc(self):
         """启动 frpc"""
@@ -683,14 +1363,81 @@ class StreamingLauncher:
             )
             self.processes.append(proc)
     
+    def _reload_system(self):
+        """重新加载验证服务器
+        
+        Linux/Mac: 平滑重启（新进程接管监听端口，可加载新代码）
+        Windows: 原地重新加载 Token 文件和管理密钥
+        """
+        path = "/admin/reload" if self.is_windows else "/admin/restart"
+        self.tasks.submit(
+            "reload",
+            lambda cancelled: self._admin_request("POST", path),
+            on_done=self._on_reloaded,
+            on_error=lambda e: self._on_reloaded({"code": 1, "error": str(e)})
+        )
+    
+    def _on_reloaded(self, result):
+        if result is None:
+            messagebox.showwarning("提示", "验证服务器未运行")
+            return
+        
+        if result.get("code") != 0:
+            self._log(f"✗ 重新加载失败: {result.get('error')}")
+            messagebox.showerror("错误", f"重新加载失败: {result.get('error')}")
+            return
+        
+        if self.is_windows:
+            self._log(f"✓ 验证服务器已重新加载，Token 数量: {result.get('total_tokens')}")
+        else:
+            self._log("✓ 验证服务器正在平滑重启")
+        self.status_label.config(text="✓ 验证服务器已重新加载")
+        self._refresh_token_list()
+    
+    def _stop_auth_server_by_pid(self):
+        """平滑重启后验证服务器已换成新进程，按 PID 文件停止它"""
+        pid_file = self.root_dir / "auth" / "server.pid"
+        if not pid_file.exists():
+            return
+        
+        try:
+            pid = int(pid_file.read_text(encoding='utf-8').strip())
+        except (ValueError, OSError):
+            return
+        if pid in [proc.pid for proc in self.processes]:
+            return
+        
+        # PID 文件可能是上次异常退出留下的，PID 已被其他进程复用；
+        # 只有 /health 报告的正是这个 PID 时才发送信号
+        try:
+            with urllib.request.urlopen(self.auth_api + "/health", timeout=1) as resp:
+                running = json.load(resp).get("pid")
+        except (urllib.error.URLError, OSError, ValueError):
+            return
+        if running != pid:
+            self._log(f"⚠ PID 文件中的进程 {pid} 不是验证服务器，未停止")
+            return
+        
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+    
     def _stop_system(self):
         """停止系统"""
         self._log("="*50)
         self._log("正在停止所有服务...")
         
+        # 还在启动中则取消剩余的启动步骤
+        if self.tasks.cancel("system"):
+            self._log("已取消启动")
+        
         for proc in self.processes:
             proc.terminate()
         
+        if not self.is_windows:
+            self._stop_auth_server_by_pid()
+        
         self.processes = []
         
         self.is_running = False
@@ -714,6 +1461,29 @@ class StreamingLauncher:
                 "请手动关闭所有服务窗口:\n\n- 验证服务器\n- SRS\n- frpc"
             )
     
+    def _on_close(self):
+        """关闭窗口：在后台保存尚未保存的 Token 修改，保存完成后再退出"""
+        if self._closing:
+            if messagebox.askyesno("提示", "Token 修改仍在保存中，是否放弃保存直接退出？"):
+                self._destroy()
+            return
+        
+        if self._token_edit_timer is not None:
+            self.root.after_cancel(self._token_edit_timer)
+            self._token_edit_timer = None
+        if not self._token_edits and not self.tasks.busy("token_edits"):
+            self._destroy()
+            return
+        
+        # 正在保存的一批完成后 _after_token_edits 会继续保存剩余修改并退出
+        self._closing = True
+        self.status_label.config(text="正在保存 Token 修改，完成后自动退出...")
+        self._flush_token_edits()
+    
+    def _destroy(self):
+        self.tasks.shutdown()
+        self.root.destroy()
+    
     def run(self):
         """运行主循环"""
         self.root.mainloop()
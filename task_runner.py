@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+启动器的后台任务 - 把文件和网络操作移出 Tk 主线程
+
+任务在线程池中执行，结果放入队列，由主线程用 root.after 定时取出并回调，
+所有界面操作都只在主线程进行。每个任务有一个 key:
+  - 同一 key 提交新任务时取消旧任务（未开始的直接取消，已在运行的结果被丢弃）
+  - 同一 key 的任务不会同时执行: 旧任务还在运行时，新任务排在它后面，
+    等它结束后才开始（例如两次保存同一个文件不会有两个线程同时写）
+  - 任务函数收到一个 threading.Event，长时间运行的任务应定期检查它以便尽早停止
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
+
+
+class Task:
+    """一个已提交的后台任务"""
+
+    __slots__ = ('key', 'on_done', 'on_error', 'cancelled', 'future')
+
+    def __init__(self, key, on_done, on_error):
+        self.key = key
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancelled = threading.Event()
+        self.future = None
+
+
+class TaskRunner:
+    """线程池 + 结果队列（submit/cancel/busy 只能在主线程调用，post 可在任意线程调用）"""
+
+    def __init__(self, root, workers=4, poll_ms=50):
+        self.root = root
+        self.poll_ms = poll_ms
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='launcher')
+        self._results = queue.Queue()
+        self._tasks = {}
+        # key -> 最近一个已交给线程池的任务的 future，新任务等它结束再开始
+        self._started = {}
+        self._start_lock = threading.Lock()
+        self.root.after(self.poll_ms, self._drain)
+
+    def submit(self, key, fn, on_done=None, on_error=None):
+        """
+        在后台执行 fn(cancelled)
+
+        成功时在主线程调用 on_done(结果)，出错时调用 on_error(异常)；
+        任务被取消后两者都不会调用
+        """
+        self.cancel(key)
+        task = Task(key, on_done, on_error)
+        self._tasks[key] = task
+        
+        with self._start_lock:
+            previous = self._started.get(key)
+        if previous is not None and not previous.done():
+            # 在旧任务结束时开始（回调在线程池线程中执行；旧任务已结束时立即执行）
+            previous.add_done_callback(lambda _: self._start(task, fn))
+        else:
+            self._start(task, fn)
+        return task
+    
+    def _start(self, task, fn):
+        """把任务交给线程池（等待期间已被取消的跳过）"""
+        with self._start_lock:
+            if task.cancelled.is_set():
+                return
+            try:
+                task.future = self._pool.submit(self._run, task, fn)
+            except RuntimeError:
+                # 线程池已关闭
+                return
+            self._started[task.key] = task.future
+
+    def _run(self, task, fn):
+        try:
+            result = fn(task.cancelled)
+        except Exception as e:
+            self._results.put((task, False, e))
+        else:
+            self._results.put((task, True, result))
+
+    def busy(self, key):
+        return key in self._tasks
+
+    def cancel(self, key):
+        """取消 key 对应的任务，返回是否有任务被取消"""
+        task = self._tasks.pop(key, None)
+        if task is None:
+            return False
+        task.cancelled.set()
+        with self._start_lock:
+            if task.future is not None:
+                task.future.cancel()
+        return True
+
+    def post(self, callback, *args):
+        """安排 callback(*args) 在主线程执行（供后台任务输出日志等）"""
+        self._results.put((None, callback, args))
+
+    def _drain(self):
+        """主线程: 处理队列中已完成的任务"""
+        try:
+            while True:
+                try:
+                    task, ok, value = self._results.get_nowait()
+                except queue.Empty:
+                    break
+
+                if task is None:
+                    ok(*value)
+                    continue
+                # 已被取消或被同 key 的新任务替换
+                if self._tasks.get(task.key) is not task:
+                    continue
+                del self._tasks[task.key]
+
+                callback = task.on_done if ok else task.on_error
+                if callback is not None:
+                    callback(value)
+                elif not ok:
+                    print(f"后台任务 {task.key} 失败: {value}")
+        finally:
+            self.root.after(self.poll_ms, self._drain)
+
+    def shutdown(self):
+        """取消所有任务；已在运行的任务在后台执行完毕"""
+        for key in list(self._tasks):
+            self.cancel(key)
+        self._pool.shutdown(wait=False, cancel_futures=True)
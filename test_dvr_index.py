@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DVR 录像索引测试 - 用合成的 FLV 文件检查 dvr_index.py
+
+用法:
+  python -m pytest test_dvr_index.py
+
+合成录像: onMetaData + AVC/AAC 序列头，之后每 40ms 一个视频帧和一个音频帧，
+每秒一个关键帧。
+"""
+
+import struct
+
+from dvr_index import (
+    FlvIndex, scan_tags, TAG_AUDIO, TAG_VIDEO, TAG_SCRIPT, TAG_HEADER_SIZE, PREV_TAG_SIZE
+)
+
+FRAME_MS = 40
+KEYFRAME_MS = 1000
+
+
+def flv_header():
+    return b'FLV\x01\x05' + struct.pack('>I', 9) + struct.pack('>I', 0)
+
+
+def flv_tag(tag_type, timestamp, data):
+    header = bytes([tag_type]) + len(data).to_bytes(3, 'big') \
+        + (timestamp & 0xFFFFFF).to_bytes(3, 'big') + bytes([(timestamp >> 24) & 0xFF]) \
+        + b'\x00\x00\x00'
+    return header + data + struct.pack('>I', TAG_HEADER_SIZE + len(data))
+
+
+def make_flv(duration_ms):
+    """返回 (文件内容, 每个 tag 的 (偏移, 类型, 时间戳, 是否关键帧))"""
+    parts = [flv_header()]
+    tags = []
+
+    def add(tag_type, timestamp, data, keyframe=False):
+        offset = sum(len(p) for p in parts)
+        parts.append(flv_tag(tag_type, timestamp, data))
+        tags.append((offset, tag_type, timestamp, keyframe))
+
+    add(TAG_SCRIPT, 0, b'\x02\x00\x0aonMetaData\x08\x00\x00\x00\x00')
+    add(TAG_VIDEO, 0, b'\x17\x00\x00\x00\x00config')
+    add(TAG_AUDIO, 0, b'\xaf\x00\x12\x10')
+    for ts in range(0, duration_ms, FRAME_MS):
+        keyframe = ts % KEYFRAME_MS == 0
+        add(TAG_VIDEO, ts, (b'\x17' if keyframe else b'\x27') + b'\x01\x00\x00\x00frame', keyframe)
+        add(TAG_AUDIO, ts, b'\xaf\x01audio')
+    return b''.join(parts), tags
+
+
+def index_state(index):
+    return (index.data_offset, index.end_offset, index.duration, index.script_offset,
+            index.video_config, index.audio_config, list(index.times), list(index.offsets))
+
+
+def write_recording(tmp_path, data, name='rec.flv'):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return path
+
+
+def test_keyframes_and_sequence_headers(tmp_path):
+    data, tags = make_flv(5000)
+    index = FlvIndex.open(write_recording(tmp_path, data))
+
+    keyframes = [(ts, offset) for offset, _, ts, keyframe in tags if keyframe]
+    assert list(zip(index.times, index.offsets)) == keyframes
+    assert index.script_offset == tags[0][0]
+    assert index.video_config == tags[1][0]
+    assert index.audio_config == tags[2][0]
+    assert index.end_offset == len(data)
+    assert index.duration == 5000 - FRAME_MS
+
+
+def test_partial_trailing_tag_resumes_after_growth(tmp_path):
+    data, tags = make_flv(3000)
+    last_offset = tags[-1][0]
+    path = write_recording(tmp_path, data[:last_offset + 5])
+
+    partial = FlvIndex.open(path)
+    assert partial.end_offset == last_offset
+
+    with open(path, 'ab') as f:
+        f.write(data[last_offset + 5:])
+    resumed = FlvIndex.open(path)
+
+    full = FlvIndex.open(write_recording(tmp_path, data, 'full.flv'))
+    assert index_state(resumed) == index_state(full)
+
+
+def test_seek_and_byte_range(tmp_path):
+    data, tags = make_flv(5000)
+    index = FlvIndex.open(write_recording(tmp_path, data))
+    keyframe = {ts: offset for offset, _, ts, is_key in tags if is_key}
+
+    assert index.seek(2500) == (2000, keyframe[2000])
+    assert index.seek(2000) == (2000, keyframe[2000])
+    assert index.seek(-1) == (0, keyframe[0])
+    assert index.seek(99999) == (4000, keyframe[4000])
+
+    assert index.byte_range(1500, 3200) == (1000, keyframe[1000], keyframe[4000])
+    # 结束时间之后没有关键帧时到已扫描部分的末尾
+    assert index.byte_range(3500, 4500) == (3000, keyframe[3000], len(data))
+
+
+def test_extract_clip_rebases_and_keeps_headers(tmp_path):
+    data, tags = make_flv(5000)
+    index = FlvIndex.open(write_recording(tmp_path, data))
+    out_path = tmp_path / 'clip.flv'
+
+    size = index.extract_clip(2300, 3100, out_path)
+    clip = out_path.read_bytes()
+    assert size == len(clip)
+    assert clip[:index.data_offset] == data[:index.data_offset]
+
+    out = list(scan_tags(clip, index.data_offset, len(clip)))
+    assert [t[1] for t in out[:3]] == [TAG_SCRIPT, TAG_VIDEO, TAG_AUDIO]
+    assert [t[3] for t in out[:3]] == [0, 0, 0]
+
+    # 片段从 2000ms 的关键帧开始，到 4000ms 的关键帧之前结束，时间戳平移到 0
+    media = out[3:]
+    expected = [(tag_type, ts - 2000) for _, tag_type, ts, _ in tags[3:] if 2000 <= ts < 4000]
+    assert [(t[1], t[3]) for t in media] == expected
+    first = media[0][0] + TAG_HEADER_SIZE
+    assert clip[first] == 0x17
+
+    # 数据部分原样拷贝
+    source = {(tag_type, ts): offset for offset, tag_type, ts, _ in tags[3:]}
+    for offset, tag_type, data_size, ts in media:
+        original = source[(tag_type, ts + 2000)] + TAG_HEADER_SIZE
+        copied = offset + TAG_HEADER_SIZE
+        assert clip[copied:copied + data_size + PREV_TAG_SIZE] == \
+            data[original:original + data_size + PREV_TAG_SIZE]
+
+    index.extract_clip(2300, 3100, tmp_path / 'raw.flv', rebase=False)
+    raw = (tmp_path / 'raw.flv').read_bytes()
+    assert [t[3] for t in scan_tags(raw, index.data_offset, len(raw))][3] == 2000
+
+
+class CancelAfter:
+    """第 n 次检查后变为已取消（模拟用户中途取消）"""
+
+    def __init__(self, n):
+        self.remaining = n
+
+    def is_set(self):
+        self.remaining -= 1
+        return self.remaining < 0
+
+
+def test_cancelled_scan_resumes_to_full_index(tmp_path):
+    data, _ = make_flv(5000)
+    path = write_recording(tmp_path, data)
+
+    partial = FlvIndex.open(path, cancelled=CancelAfter(40))
+    assert 0 < partial.end_offset < len(data)
+
+    resumed = FlvIndex.open(path)
+    full = FlvIndex.open(write_recording(tmp_path, data, 'full.flv'))
+    assert index_state(resumed) == index_state(full)
+    assert FlvIndex.load(path) is not None
+    assert index_state(FlvIndex.load(path)) == index_state(full)
+
+
+def test_corrupt_or_truncated_index_is_rebuilt(tmp_path):
+    data, _ = make_flv(5000)
+    path = write_recording(tmp_path, data)
+    full = index_state(FlvIndex.open(path))
+    index_path = path.with_name(path.name + '.idx')
+    saved = index_path.read_bytes()
+
+    index_path.write_bytes(saved[:len(saved) - 7])
+    assert FlvIndex.load(path) is None
+    assert index_state(FlvIndex.open(path)) == full
+
+    index_path.write_bytes(b'garbage' * 20)
+    assert FlvIndex.load(path) is None
+    assert index_state(FlvIndex.open(path)) == full
+    assert index_path.read_bytes() == saved